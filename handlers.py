@@ -15,6 +15,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hsreplaynet.settings")
 os.environ.setdefault("IS_RUNNING_AS_LAMBDA", "True")
 django.setup()
 from django.conf import settings
+from django.core.management import call_command
+
+# The shared cache lives in the database (see settings.CACHES).
+# Lambdas can be deployed ahead of the web servers which also create it.
+call_command("createcachetable")
 
 
 class TracingIdAwareFormatter(logging.Formatter):
@@ -42,3 +47,4 @@ logging.getLogger("boto").setLevel(logging.WARN)
 from hsreplaynet.lambdas.authorizer import api_gateway_authorizer as token_authorizer
 from hsreplaynet.lambdas.uploads import create_power_log_upload_event_handler
 from hsreplaynet.lambdas.uploads import process_upload_event_handler
+from hsreplaynet.lambdas.uploads import uploaded_file_notification_handler
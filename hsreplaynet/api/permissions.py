@@ -10,15 +10,23 @@ class APIKeyPermission(permissions.BasePermission):
 
 	HEADER_NAME = "X-Api-Key"
 
-	def has_permission(self, request, view):
-		header = "HTTP_" + self.HEADER_NAME.replace("-", "_").upper()
-		key = request.META.get(header, "")
+	@staticmethod
+	def get_api_key(key):
+		"""
+		Returns the APIKey matching `key`, or None.
+		"""
 		if not key:
-			return False
+			return None
 
 		try:
-			api_key = APIKey.objects.get(api_key=key)
+			return APIKey.objects.get(api_key=key)
 		except (APIKey.DoesNotExist, ValueError):
+			return None
+
+	def has_permission(self, request, view):
+		header = "HTTP_" + self.HEADER_NAME.replace("-", "_").upper()
+		api_key = self.get_api_key(request.META.get(header, ""))
+		if api_key is None:
 			return False
 
 		request.api_key = api_key
@@ -1,10 +1,8 @@
-import json
-from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework import serializers
 from hsreplaynet.games.models import GameReplay, GlobalGame, GlobalGamePlayer
 from hsreplaynet.stats import models as stats_models
 from hsreplaynet.uploads.models import UploadEvent
-from hsreplaynet.utils import get_client_ip
+from hsreplaynet.uploads.presigned import generate_put_url
 from .models import AuthToken, APIKey
 
 
@@ -129,19 +127,33 @@ class UploadEventSerializer(serializers.Serializer):
 	player2 = PlayerSerializer(required=False, write_only=True)
 
 	def create(self, data):
-		request = self.context["request"]
-
-		ret = UploadEvent(
-			file=data.pop("file"),
-			token=request.auth_token,
-			api_key=request.api_key,
+		# token, api_key and upload_ip are passed to save() by the caller
+		return UploadEvent.objects.create_from_metadata(
 			type=data.pop("type"),
-			upload_ip=get_client_ip(request),
+			token=data.pop("token"),
+			api_key=data.pop("api_key"),
+			upload_ip=data.pop("upload_ip"),
+			file=data.pop("file", None),
+			metadata=data,
 		)
-		ret.metadata = json.dumps(data, cls=DjangoJSONEncoder)
-		ret.save()
 
-		return ret
+
+class UploadRequestSerializer(UploadEventSerializer):
+	"""
+	Creates an UploadEvent without its file. The client uploads the file
+	directly to the storage with the returned `put_url`, gzipped and with
+	a `Content-Encoding: gzip` header (raw uploads are stored compressed).
+	"""
+	put_url = serializers.SerializerMethodField()
+
+	def get_fields(self):
+		fields = super(UploadRequestSerializer, self).get_fields()
+		# The file is uploaded separately
+		del fields["file"]
+		return fields
+
+	def get_put_url(self, instance):
+		return generate_put_url(instance, self.context["request"])
 
 
 class GlobalGamePlayerSerializer(serializers.ModelSerializer):
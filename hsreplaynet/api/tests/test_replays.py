@@ -0,0 +1,69 @@
+import time
+from mock import patch
+from django.test import TestCase
+from hsreplaynet.games.models import REPLAY_PAGE_CACHE_TIMEOUT, Visibility
+from hsreplaynet.test.base import ReplayFixtureMixin
+
+
+class TestGameReplayList(ReplayFixtureMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.url = "/api/v1/games/"
+
+	def get_shortids(self, params=None):
+		response = self.client.get(self.url, params or {})
+		self.assertEqual(response.status_code, 200)
+		return [replay["shortid"] for replay in response.data["results"]]
+
+	def test_list_filters(self):
+		won = self.create_replay(0, won=True)
+		lost = self.create_replay(1, won=False, friendly_player_id=2)
+		unlisted = self.create_replay(2, won=True, visibility=Visibility.Unlisted)
+
+		self.assertEqual(self.get_shortids(), [lost.shortid, won.shortid])
+		self.assertEqual(self.get_shortids({"won": "true"}), [won.shortid])
+		self.assertEqual(self.get_shortids({"hero": "HERO_08"}), [lost.shortid])
+		self.assertEqual(self.get_shortids({"user": "nobody"}), [])
+		self.assertEqual(
+			self.get_shortids({"match_start_after": "2016-07-14T03:30:00Z"}), [lost.shortid]
+		)
+
+		# Unlisted replays are listed for their owner only
+		self.client.login(username="player", password="password")
+		self.assertEqual(self.get_shortids(), [unlisted.shortid, lost.shortid, won.shortid])
+
+	def test_invalid_filter(self):
+		response = self.client.get(self.url, {"game_type": "ranked"})
+		self.assertEqual(response.status_code, 400)
+
+	def test_if_none_match(self):
+		self.create_replay(0)
+		response = self.client.get(self.url)
+		etag = response["ETag"]
+
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+
+		self.create_replay(1)
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(response.data["results"]), 2)
+
+	def test_if_none_match_in_place_edit(self):
+		replay = self.create_replay(0, won=True)
+		etag = self.client.get(self.url)["ETag"]
+
+		replay.won = False
+		replay.save()
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(response.data["results"][0]["won"])
+
+	def test_if_none_match_expires_before_replay_urls(self):
+		self.create_replay(0)
+		etag = self.client.get(self.url)["ETag"]
+
+		later = time.time() + REPLAY_PAGE_CACHE_TIMEOUT
+		with patch("hsreplaynet.api.views.time.time", return_value=later):
+			response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
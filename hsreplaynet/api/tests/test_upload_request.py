@@ -0,0 +1,67 @@
+import gzip
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from hsreplaynet.test.base import create_agent_and_token
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+
+
+@override_settings(UPLOAD_PROCESSING_BACKEND="workers")
+class TestUploadRequest(TestCase):
+	def setUp(self):
+		super().setUp()
+		self.agent, self.token = create_agent_and_token()
+		self.url = "/api/v1/upload_request/"
+		self.headers = {
+			"HTTP_AUTHORIZATION": "Token %s" % (self.token.key),
+			"HTTP_X_API_KEY": str(self.agent.api_key),
+		}
+
+	def request_upload(self):
+		data = {
+			"type": int(UploadEventType.POWER_LOG),
+			"build": 13740,
+			"match_start": "2016-07-14T03:00:00Z",
+		}
+		return self.client.post(self.url, data, **self.headers)
+
+	def test_request_upload_then_put(self):
+		response = self.request_upload()
+		self.assertEqual(response.status_code, 201)
+		upload = UploadEvent.objects.get()
+		self.assertEqual(upload.status, UploadEventStatus.PENDING_UPLOAD)
+
+		put_url = response.data["put_url"]
+		response = self.client.put(put_url, b"D 03:00:00.0000000 GameState.DebugPrintPower()")
+		self.assertEqual(response.status_code, 200)
+
+		upload.refresh_from_db()
+		self.assertEqual(upload.status, UploadEventStatus.UNKNOWN)
+		self.assertTrue(default_storage.exists(upload.file.name))
+		upload.file.delete(save=False)
+
+		# The URL cannot be used twice
+		response = self.client.put(put_url, b"")
+		self.assertEqual(response.status_code, 404)
+
+	def test_put_gzipped(self):
+		response = self.request_upload()
+		put_url = response.data["put_url"]
+		data = b"D 03:00:00.0000000 GameState.DebugPrintPower()"
+		response = self.client.put(put_url, gzip.compress(data), HTTP_CONTENT_ENCODING="gzip")
+		self.assertEqual(response.status_code, 200)
+
+		upload = UploadEvent.objects.get()
+		self.assertEqual(upload.status, UploadEventStatus.UNKNOWN)
+		upload.file.open("rb")
+		self.assertEqual(upload.file.read(), data)
+		upload.file.close()
+		upload.file.delete(save=False)
+
+	def test_put_with_invalid_signature(self):
+		response = self.client.put("/uploads/put/invalid:signature/", b"")
+		self.assertEqual(response.status_code, 403)
+
+	def test_missing_api_key_raises_403(self):
+		del self.headers["HTTP_X_API_KEY"]
+		response = self.request_upload()
+		self.assertEqual(response.status_code, 403)
@@ -13,5 +13,6 @@ urlpatterns = [
 	url(r"^v1/", include(router.urls)),
 	url(r"^v1/claim_account/", views.CreateAccountClaimView.as_view()),
 	url(r"^v1/stats/", views.CreateStatsSnapshotView.as_view()),
+	url(r"^v1/upload_request/", views.CreateUploadRequestView.as_view()),
 	url(r"^api-auth/", include("rest_framework.urls", namespace="rest_framework")),
 ]
@@ -1,13 +1,24 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.db.models import F, Q, prefetch_related_objects
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 from rest_framework.authentication import SessionAuthentication
-from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin
 from rest_framework.generics import CreateAPIView
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
-from rest_framework.status import HTTP_201_CREATED
+from rest_framework.status import HTTP_201_CREATED, HTTP_304_NOT_MODIFIED
 from hsreplaynet.accounts.models import AccountClaim
-from hsreplaynet.games.models import GameReplay
+from hsreplaynet.games.models import (
+	REPLAY_API_CACHE_KEY, REPLAY_PAGE_CACHE_TIMEOUT, GameReplay, Visibility
+)
 from hsreplaynet.uploads.models import UploadEvent
+from hsreplaynet.utils import aware_datetime, get_client_ip
 from . import serializers
 from .authentication import AuthTokenAuthentication, RequireAuthToken
 from .models import AuthToken, APIKey
@@ -44,18 +55,144 @@ class CreateAccountClaimView(CreateAPIView):
 		return response
 
 
-class UploadEventViewSet(WriteOnlyOnceViewSet):
+class CreateUploadEventMixin(object):
 	authentication_classes = (AuthTokenAuthentication, SessionAuthentication)
 	permission_classes = (RequireAuthToken, APIKeyPermission)
+
+	def perform_create(self, serializer):
+		request = self.request
+		serializer.save(
+			token=getattr(request, "auth_token", None),
+			api_key=request.api_key,
+			upload_ip=get_client_ip(request),
+		)
+
+
+class UploadEventViewSet(CreateUploadEventMixin, WriteOnlyOnceViewSet):
 	queryset = UploadEvent.objects.all()
 	serializer_class = serializers.UploadEventSerializer
 
 
-class GameReplayViewSet(RetrieveModelMixin, GenericViewSet):
+class CreateUploadRequestView(CreateUploadEventMixin, CreateAPIView):
+	serializer_class = serializers.UploadRequestSerializer
+
+
+class GameReplayCursorPagination(CursorPagination):
+	# Served by the (match_start, id) index; id makes the ordering unique
+	ordering = ("-match_start", "-id")
+	page_size = 50
+
+
+def parse_bool(value):
+	if value.lower() in ("true", "1"):
+		return True
+	elif value.lower() in ("false", "0"):
+		return False
+	raise ValueError("Invalid boolean: %r" % (value))
+
+
+class GameReplayViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+	"""
+	Lists public replays, and the user's own replays whatever their visibility.
+
+	The listing can be filtered with the following query parameters:
+	user (username), game_type, hero (card ID of the friendly player's hero),
+	won (true or false), match_start_after and match_start_before (ISO 8601).
+	It is paginated with a cursor, most recent replays first, and
+	supports conditional requests with ETag / If-None-Match.
+	"""
+	authentication_classes = (AuthTokenAuthentication, SessionAuthentication)
 	queryset = GameReplay.objects.all()
 	serializer_class = serializers.GameReplaySerializer
+	pagination_class = GameReplayCursorPagination
 	lookup_field = "shortid"
 
+	FILTERS = {
+		"user": ("user__username", str),
+		"game_type": ("global_game__game_type", int),
+		"won": ("won", parse_bool),
+		"match_start_after": ("match_start__gte", aware_datetime),
+		"match_start_before": ("match_start__lt", aware_datetime),
+	}
+
+	def get_queryset(self):
+		queryset = super(GameReplayViewSet, self).get_queryset()
+		return queryset.select_related("user", "global_game")
+
+	def filter_queryset(self, queryset):
+		queryset = super(GameReplayViewSet, self).filter_queryset(queryset)
+		if self.action != "list":
+			# Unlisted replays can still be retrieved by shortid
+			return queryset
+
+		params = self.request.query_params
+		user = self.request.user
+		visible = Q(visibility=Visibility.Public)
+		if user and user.is_authenticated():
+			visible |= Q(user=user)
+		queryset = queryset.filter(visible, is_deleted=False)
+
+		for param, (lookup, parse) in self.FILTERS.items():
+			if param not in params:
+				continue
+			try:
+				value = parse(params[param])
+			except (ValueError, OverflowError):
+				raise ValidationError({param: "Invalid value: %r" % (params[param])})
+			queryset = queryset.filter(**{lookup: value})
+
+		if "hero" in params:
+			# Both conditions in a single filter() apply to the same player row
+			queryset = queryset.filter(
+				global_game__players__player_id=F("friendly_player_id"),
+				global_game__players__hero_id=params["hero"],
+			)
+
+		return queryset
+
+	def retrieve(self, request, *args, **kwargs):
+		shortid = kwargs[self.lookup_field]
+		key = REPLAY_API_CACHE_KEY % (shortid)
+		data = cache.get(key)
+		if data is None:
+			try:
+				replay = GameReplay.objects.get_cached(shortid)
+			except GameReplay.DoesNotExist:
+				raise NotFound()
+			data = self.get_serializer(replay).data
+			cache.set(key, data, REPLAY_PAGE_CACHE_TIMEOUT)
+		return Response(data)
+
+	def get_list_etag(self, request, page):
+		# A listing response is made of the page's replays and the links to the
+		# adjacent pages. `updated` changes whenever a replay or its game does.
+		# The replays' presigned XML URLs expire, so the ETag changes every
+		# REPLAY_PAGE_CACHE_TIMEOUT seconds to hand out fresh ones in time.
+		key = "%s:%s:%i:%s:%s:%s" % (
+			request.get_full_path(),
+			request.user.pk,
+			int(time.time()) // REPLAY_PAGE_CACHE_TIMEOUT,
+			",".join("%i@%s" % (replay.id, replay.updated.isoformat()) for replay in page),
+			self.paginator.get_next_link(),
+			self.paginator.get_previous_link(),
+		)
+		return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+	def list(self, request, *args, **kwargs):
+		page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+		etag = self.get_list_etag(request, page)
+		if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+		if etag in if_none_match or "*" in if_none_match:
+			response = Response(status=HTTP_304_NOT_MODIFIED)
+		else:
+			# The players are only needed to render the page
+			prefetch_related_objects(page, "global_game__players")
+			serializer = self.get_serializer(page, many=True)
+			response = self.get_paginated_response(serializer.data)
+		response["ETag"] = quote_etag(etag)
+		patch_vary_headers(response, ("Authorization", "Cookie"))
+		return response
+
 
 class CreateStatsSnapshotView(CreateAPIView):
 	authentication_classes = (AuthTokenAuthentication, )
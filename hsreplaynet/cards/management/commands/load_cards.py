@@ -1,19 +1,49 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from hearthstone import cardxml
+from hsreplaynet.utils.db import bulk_update
 from ...models import Card
 
 
 class Command(BaseCommand):
+	def add_arguments(self, parser):
+		parser.add_argument("--batch-size", type=int, default=500)
+
 	def handle(self, *args, **options):
+		batch_size = options["batch_size"]
 		db, _ = cardxml.load()
-		created = 0
 
 		self.stdout.write("%i cards available" % (len(db)))
 
+		existing = {obj.id: obj for obj in Card.objects.all()}
+		new_cards, updated_cards = [], []
+		updated_fields = set()
+		unchanged = 0
+
 		for card in db.values():
-			obj, created = Card.objects.get_or_create_from_cardxml(card)
-			if created:
+			values = Card.objects.get_cardxml_values(card)
+			obj = existing.get(card.id)
+			if obj is None:
+				obj = Card(id=card.id, **values)
 				self.stdout.write("New card: %r (%s)" % (obj, obj.id))
-				created += 1
+				new_cards.append(obj)
+				continue
+
+			changed = [k for k, v in values.items() if getattr(obj, k) != v]
+			if changed:
+				for k in changed:
+					setattr(obj, k, values[k])
+				updated_fields.update(changed)
+				updated_cards.append(obj)
+			else:
+				unchanged += 1
+
+		with transaction.atomic():
+			Card.objects.bulk_create(new_cards, batch_size=batch_size)
+			if updated_cards:
+				bulk_update(Card, updated_cards, sorted(updated_fields), batch_size=batch_size)
 
-		self.stdout.write("%i new cards" % (created))
+		self.stdout.write("%i new cards, %i updated, %i unchanged" % (
+			len(new_cards), len(updated_cards), unchanged
+		))
+		Card.objects.invalidate_card_db_version()
@@ -1,10 +1,21 @@
 import hashlib
 import random
-from django.db import models
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
 from hearthstone import enums
+from hsreplaynet.utils import LRUCache, generate_key
 from hsreplaynet.utils.fields import IntEnumField
 
 
+CARD_DB_VERSION_CACHE_KEY = "cards:version"
+
+# Valid deck list card sets by card DB version. Only the version is looked
+# up in the shared cache; the set itself is kept in-process.
+valid_deck_list_card_sets = LRUCache(2)
+
+
 class CardManager(models.Manager):
 	def random(self, cost=None, collectible=True, card_class=None):
 		"""
@@ -31,28 +42,49 @@ class CardManager(models.Manager):
 		Returns a tuple with the object and a boolean to indicate
 		whether it was created.
 		"""
-		qs = Card.objects.filter(id=card.id)
-		if qs.exists():
-			return qs.first(), False
+		obj = Card.objects.filter(id=card.id).first()
+		if obj:
+			return obj, False
 
-		obj = Card(id=card.id)
+		obj = Card(id=card.id, **self.get_cardxml_values(card))
+		obj.save()
+		return obj, True
 
-		for k in dir(card):
-			if k.startswith("_"):
-				continue
+	def get_cardxml_values(self, card):
+		"""
+		Returns a dict of the model field values found on a CardXML object.
+		"""
+		ret = {}
+		for field in Card._meta.concrete_fields:
 			# Transfer all existing CardXML attributes to our model
-			if hasattr(obj, k):
-				setattr(obj, k, getattr(card, k))
+			if field.name != "id" and hasattr(card, field.name):
+				ret[field.name] = getattr(card, field.name)
+		return ret
 
-		obj.save()
-		return obj, True
+	def get_card_db_version(self):
+		"""
+		Returns an opaque token identifying the current contents of the card DB.
+		It changes every time the cards are reloaded (see load_cards).
+		"""
+		version = cache.get(CARD_DB_VERSION_CACHE_KEY)
+		if version is None:
+			# No version known yet (or it was evicted); start a new one.
+			cache.add(CARD_DB_VERSION_CACHE_KEY, generate_key(), None)
+			version = cache.get(CARD_DB_VERSION_CACHE_KEY)
+		return version
+
+	def invalidate_card_db_version(self):
+		cache.set(CARD_DB_VERSION_CACHE_KEY, generate_key(), None)
 
 	def get_valid_deck_list_card_set(self):
-		if not hasattr(self, "_usable_cards"):
+		version = self.get_card_db_version()
+		ret = valid_deck_list_card_sets.get(version)
+		if ret is None:
 			card_list = Card.objects.filter(collectible=True).exclude(type=enums.CardType.HERO)
-			self._usable_cards = set(c[0] for c in card_list.values_list("id"))
+			ret = set(c[0] for c in card_list.values_list("id"))
+			valid_deck_list_card_sets.set(version, ret)
 
-		return self._usable_cards
+		return ret
 
 
 class Card(models.Model):
@@ -107,6 +139,12 @@ class Card(models.Model):
 		return self.name
 
 
+# Maps deck digests to Deck ids. Popular decks show up in a large fraction
+# of uploads; this lets the processing workers skip the lookup for them.
+# Lives for the whole process, so it survives across warm Lambda invocations.
+deck_digest_cache = LRUCache(getattr(settings, "DECK_DIGEST_CACHE_SIZE", 10000))
+
+
 class DeckManager(models.Manager):
 	def random_deck_list_of_size(self, size):
 		card_class = random.randint(2, 10)  # enums.CardClass
@@ -117,28 +155,39 @@ class DeckManager(models.Manager):
 				result.append(candidate_card.id)
 		return result
 
+	def _cache_deck_id(self, deck):
+		# Only cache the deck once it is committed; a rolled back
+		# transaction would otherwise leave a dangling id in the cache.
+		transaction.on_commit(lambda: deck_digest_cache.set(deck.digest, deck.id))
+
 	def get_or_create_from_id_list(self, id_list):
 		digest = generate_digest_from_deck_list(id_list)
+		deck_id = deck_digest_cache.get(digest)
+		if deck_id is not None:
+			# Only the reference to the deck is known, which is enough to link to it.
+			return (Deck(id=deck_id, digest=digest), False)
+
 		existing_deck = Deck.objects.filter(digest=digest).first()
 		if existing_deck:
+			self._cache_deck_id(existing_deck)
 			return (existing_deck, False)
 
-		deck = Deck.objects.create(digest=digest)
-
-		for card_id in id_list:
-			include, created = deck.include_set.get_or_create(
-				deck=deck,
-				card_id=card_id,
-				defaults={"count": 1}
-			)
-
-			if not created:
-				# This must be an additional copy of a card we've
-				# seen previously so we increment the count
-				include.count += 1
-				include.save()
-
-		deck.save()
+		try:
+			with transaction.atomic():
+				# The digest is computed from the same list, so it does not
+				# need to be recalculated from the includes afterwards.
+				deck = Deck.objects.create(digest=digest)
+				Include.objects.bulk_create([
+					Include(deck=deck, card_id=card_id, count=count)
+					for card_id, count in Counter(id_list).items()
+				])
+		except IntegrityError:
+			# The same deck was created concurrently
+			deck = Deck.objects.get(digest=digest)
+			self._cache_deck_id(deck)
+			return (deck, False)
+
+		self._cache_deck_id(deck)
 		return (deck, True)
 
 
@@ -176,7 +225,10 @@ class Deck(models.Model):
 
 	def save(self, *args, **kwargs):
 		EMPTY_DECK_DIGEST = 'd41d8cd98f00b204e9800998ecf8427e'
-		if self.digest != EMPTY_DECK_DIGEST and self.include_set.count() == 0:
+		if self.pk is None and self.digest != EMPTY_DECK_DIGEST:
+			# A new deck has no includes yet, so the digest was set by hand.
+			return super(Deck, self).save(*args, **kwargs)
+		elif self.digest != EMPTY_DECK_DIGEST and self.include_set.count() == 0:
 			# A client has set a digest by hand, so don't recalculate it.
 			return super(Deck, self).save(*args, **kwargs)
 		else:
@@ -188,7 +240,7 @@ class Deck(models.Model):
 
 		for i in self.include_set.all():
 			for n in range(0, i.count):
-				result.append(i.card.id)
+				result.append(i.card_id)
 
 		return result
 
@@ -43,6 +43,16 @@ class DeckTests(TestCase):
 		d2, created2 = Deck.objects.get_or_create_from_id_list(thirty_card_deck)
 		self.assertEqual(d2.size(), 30)
 		self.assertFalse(created2)
+		self.assertEqual(d1.digest, d2.digest)
+		self.assertEqual(sorted(d2.card_id_list()), sorted(thirty_card_deck))
+
+	def test_get_or_create_from_id_list_num_queries(self):
+		deck_list = ["CS2_142", "CS2_142", "CS2_146", "EX1_405", "EX1_405", "GVG_081"]
+		# Lookup, savepoint, deck insert, includes insert, release savepoint
+		with self.assertNumQueries(5):
+			deck, created = Deck.objects.get_or_create_from_id_list(deck_list)
+		self.assertTrue(created)
+		self.assertEqual(deck.size(), len(deck_list))
 
 	def test_random_deck_list_of_size(self):
 		size = 30
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from ...models import GlobalGame
+
+
+class Command(BaseCommand):
+	help = "Computes the deduplication digest of GlobalGames which do not have one yet."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--chunk-size", type=int, default=1000)
+
+	def handle(self, *args, **options):
+		games = GlobalGame.objects.filter(
+			digest=None, game_server_game_id__isnull=False
+		).order_by("id")
+		self.stdout.write("%i GlobalGames to backfill" % (games.count()))
+
+		last_id = 0
+		updated, duplicates = 0, 0
+		while True:
+			chunk = list(games.filter(id__gt=last_id)[:options["chunk_size"]])
+			if not chunk:
+				break
+
+			with transaction.atomic():
+				for game in chunk:
+					try:
+						with transaction.atomic():
+							GlobalGame.objects.filter(id=game.id).update(digest=game.generate_digest())
+					except IntegrityError:
+						# Another GlobalGame already has this digest: the game was
+						# never unified. Leave it alone, it needs a manual look.
+						self.stdout.write("Duplicate of an existing GlobalGame: %r" % (game.id))
+						duplicates += 1
+					else:
+						updated += 1
+
+			last_id = chunk[-1].id
+			self.stdout.write("%i updated, %i duplicates (up to id %i)" % (updated, duplicates, last_id))
+
+		self.stdout.write("Done.")
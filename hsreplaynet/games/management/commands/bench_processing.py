@@ -0,0 +1,126 @@
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from statistics import median
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from hsreplaynet.cards.models import deck_digest_cache
+from hsreplaynet.uploads.models import UploadEvent, UploadEventType
+from hsreplaynet.utils.instrumentation import collect_spans
+from ...processing import do_process_upload_event
+
+
+class Rollback(Exception):
+	pass
+
+
+class Command(BaseCommand):
+	help = (
+		"Processes Power.log files and reports the wall time and query count "
+		"of each processing span, and the peak memory, as JSON. "
+		"Database changes are rolled back."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("file", nargs="+")
+		parser.add_argument("--build", type=int, default=0)
+		parser.add_argument("--iterations", type=int, default=3)
+		parser.add_argument(
+			"--trace-memory", action="store_true",
+			help="Measure the peak Python memory of each run (slows down processing)"
+		)
+		parser.add_argument("--output", help="Write the results to this file instead of stdout")
+
+	def handle(self, *args, **options):
+		results = OrderedDict()
+		results["started"] = now().isoformat()
+		results["database"] = connection.vendor
+		results["iterations"] = options["iterations"]
+		results["logs"] = []
+
+		for path in options["file"]:
+			self.stderr.write("Benchmarking %r" % (path))
+			runs = [self.bench_log(path, options) for i in range(options["iterations"])]
+			results["logs"].append(OrderedDict([
+				("path", path),
+				("num_bytes", os.path.getsize(path)),
+				("median", self.summarize(runs)),
+				("runs", runs),
+			]))
+
+		# ru_maxrss is in kilobytes on Linux
+		results["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+		if options["output"]:
+			with open(options["output"], "w") as f:
+				json.dump(results, f, indent="\t")
+		else:
+			json.dump(results, sys.stdout, indent="\t")
+			sys.stdout.write("\n")
+
+	def summarize(self, runs):
+		ret = OrderedDict()
+		for span in runs[0]:
+			ret[span] = OrderedDict(
+				(key, median(run[span][key] for run in runs))
+				for key in runs[0][span]
+			)
+		return ret
+
+	def count_queries(self):
+		start = len(connection.queries_log)
+		return lambda: {"num_queries": len(connection.queries_log) - start}
+
+	def bench_log(self, path, options):
+		trace_memory = options["trace_memory"]
+		meta = {
+			"build": options["build"],
+			"match_start": now().isoformat(),
+		}
+		upload_event = UploadEvent(
+			type=UploadEventType.POWER_LOG,
+			upload_ip="127.0.0.1",
+			metadata=json.dumps(meta),
+		)
+		upload_event.file = File(open(path, "rb"))
+
+		# Always measure deck creation with a cold cache
+		deck_digest_cache.clear()
+		if trace_memory:
+			tracemalloc.start()
+		replay = None
+		start_time = time.perf_counter()
+		try:
+			with CaptureQueriesContext(connection) as queries:
+				with collect_spans(self.count_queries) as spans, transaction.atomic():
+					replay = do_process_upload_event(upload_event)
+					raise Rollback()
+		except Rollback:
+			pass
+		finally:
+			if replay is not None and replay.replay_xml.name:
+				replay.replay_xml.delete(save=False)
+
+		stats = OrderedDict()
+		for point in spans:
+			stats[point["tags"]["span"]] = OrderedDict([
+				("wall_ms", point["fields"]["duration_ms"]),
+				("num_queries", point["fields"]["num_queries"]),
+			])
+
+		stats["total"] = OrderedDict([
+			("wall_ms", (time.perf_counter() - start_time) * 1000),
+			("num_queries", len(queries)),
+		])
+		if trace_memory:
+			stats["total"]["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+		return stats
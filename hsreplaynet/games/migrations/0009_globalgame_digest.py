@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0008_auto_20160712_0239'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalgame',
+            name='digest',
+            field=models.CharField(blank=True, help_text='Fingerprint of the server-side identifiers and match start bucket.', max_length=40, null=True, unique=True, verbose_name='Deduplication digest'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0009_globalgame_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamereplay',
+            name='match_start',
+            field=models.DateTimeField(blank=True, help_text='Denormalized from GlobalGame.match_start.', null=True, verbose_name='Match Start Timestamp'),
+        ),
+        migrations.RunSQL(
+            "UPDATE games_gamereplay SET match_start = ("
+            "SELECT match_start FROM games_globalgame "
+            "WHERE games_globalgame.id = games_gamereplay.global_game_id)",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterIndexTogether(
+            name='gamereplay',
+            index_together=set([('user', 'match_start', 'id')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0011_gamereplay_updated'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='gamereplay',
+            index_together=set([('user', 'match_start', 'id'), ('match_start', 'id')]),
+        ),
+    ]
@@ -1,18 +1,25 @@
+import hashlib
+import logging
 from enum import IntEnum
 from math import ceil
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
 from django.dispatch.dispatcher import receiver
 from django.utils.timezone import now
 from hearthstone.enums import BnetGameType, PlayState
 from hsreplaynet.api.models import AuthToken
 from hsreplaynet.cards.models import Card, Deck
+from hsreplaynet.utils import deduplication_bucket
 from hsreplaynet.utils.fields import IntEnumField, PlayerIDField, ShortUUIDField
 
 
+logger = logging.getLogger(__file__)
+
+
 def _generate_upload_path(instance, filename):
 	ts = now()
 	if instance.user_id:
@@ -23,6 +30,19 @@ def _generate_upload_path(instance, filename):
 	return "replays/%s/%s/%s.hsreplay.xml" % (yymmdd, token, ts.isoformat())
 
 
+def generate_global_game_digest(build, game_type, game_id, address, port, bucket):
+	"""
+	Returns the deduplication fingerprint of a game from its server-side
+	identifiers and the deduplication bucket of its match start.
+	"""
+	if game_type is not None:
+		game_type = int(game_type)
+	values = (build, game_type, game_id, address, port, bucket)
+	m = hashlib.sha1()
+	m.update(",".join(str(v) for v in values).encode("utf-8"))
+	return m.hexdigest()
+
+
 class GlobalGame(models.Model):
 	"""
 	Represents a globally unique game (e.g. from the server's POV).
@@ -34,14 +54,18 @@ class GlobalGame(models.Model):
 
 	When a replay or raw log file is uploaded the server first checks
 	for the existence of a GlobalGame record. It looks for any games
-	that occured on the same region where both players have matching
-	battle_net_ids and where the match start timestamp is within +/- 1
-	minute from the timestamp on the upload.
+	that occured on the same build, game type and game server with a
+	matching game_id and where the match start timestamp is within
+	+/- 6 hours from the timestamp on the upload.
 	The +/- range on the match start timestamp is to account for
 	potential clock drift between the computer that generated this
 	replay and the computer that uploaded the earlier record which
 	first created the GlobalGame record. If no existing GlobalGame
 	record is found, then one is created.
+
+	To keep that lookup a single index probe, the server-side identifiers
+	and the deduplication bucket of the match start are hashed into the
+	unique `digest` column (see generate_global_game_digest()).
 	"""
 	id = models.BigAutoField(primary_key=True)
 
@@ -96,6 +120,12 @@ class GlobalGame(models.Model):
 	num_turns = models.IntegerField()
 	num_entities = models.IntegerField()
 
+	# Null for games which are not eligible for deduplication
+	digest = models.CharField("Deduplication digest",
+		max_length=40, unique=True, null=True, blank=True,
+		help_text="Fingerprint of the server-side identifiers and match start bucket.",
+	)
+
 	class Meta:
 		ordering = ("-match_start", )
 
@@ -118,6 +148,12 @@ class GlobalGame(models.Model):
 	def num_own_turns(self):
 		return ceil(self.num_turns / 2)
 
+	def generate_digest(self):
+		return generate_global_game_digest(
+			self.build, self.game_type, self.game_server_game_id, self.game_server_address,
+			self.game_server_port, deduplication_bucket(self.match_start)
+		)
+
 
 class GlobalGamePlayer(models.Model):
 	id = models.BigAutoField(primary_key=True)
@@ -190,6 +226,49 @@ class GlobalGamePlayer(models.Model):
 		return self.final_state in (PlayState.WINNING, PlayState.WON)
 
 
+# Cached GameReplay objects, with everything the replay page shows
+REPLAY_CACHE_KEY = "games:replay:%s"
+REPLAY_CACHE_TIMEOUT = getattr(settings, "REPLAY_CACHE_TIMEOUT", 3600)
+# Rendered pages and API payloads include expiring (presigned) replay XML
+# URLs, so they must be cached for less time than those URLs are valid.
+REPLAY_PAGE_CACHE_KEY = "games:replay_page:%s"
+REPLAY_API_CACHE_KEY = "games:replay_api:%s"
+REPLAY_PAGE_CACHE_TIMEOUT = getattr(settings, "REPLAY_PAGE_CACHE_TIMEOUT", 300)
+
+
+class GameReplayManager(models.Manager):
+	def get_cached(self, shortid):
+		"""
+		Returns the replay with its user, global game, players, heroes and
+		deck lists, from the cache if possible.
+		Raises GameReplay.DoesNotExist if there is no such replay.
+		"""
+		key = REPLAY_CACHE_KEY % (shortid)
+		ret = cache.get(key)
+		if ret is None:
+			ret = self.select_related("user", "global_game").prefetch_related(
+				"global_game__players__hero",
+				"global_game__players__deck_list__include_set__card",
+			).get(shortid=shortid)
+			cache.set(key, ret, REPLAY_CACHE_TIMEOUT)
+		return ret
+
+	def invalidate_cache(self, shortids):
+		keys = []
+		for shortid in shortids:
+			keys += [
+				REPLAY_CACHE_KEY % (shortid),
+				REPLAY_PAGE_CACHE_KEY % (shortid),
+				REPLAY_API_CACHE_KEY % (shortid),
+			]
+		try:
+			cache.delete_many(keys)
+		except Exception:
+			# This runs after the changes are committed; failing the request
+			# (or the upload processing) would not undo them.
+			logger.exception("Could not invalidate the cache of replays %r", shortids)
+
+
 class Visibility(IntEnum):
 	Public = 1
 	Unlisted = 2
@@ -223,6 +302,10 @@ class GameReplay(models.Model):
 	class Meta:
 		ordering = ("global_game", )
 		unique_together = ("upload_token", "global_game")
+		index_together = (
+			("user", "match_start", "id"),
+			("match_start", "id"),
+		)
 
 	id = models.BigAutoField(primary_key=True)
 	shortid = ShortUUIDField("Short ID")
@@ -237,6 +320,13 @@ class GameReplay(models.Model):
 		help_text="References the single global game that this replay shows."
 	)
 
+	# Copy of global_game.match_start, so that a user's replays can be
+	# paginated on an index of the replay table alone.
+	match_start = models.DateTimeField("Match Start Timestamp",
+		null=True, blank=True,
+		help_text="Denormalized from GlobalGame.match_start.",
+	)
+
 	# This is useful to know because replays that are spectating both players
 	# will have more data then those from a single player.
 	# For example, they will have access to the cards that are in each players hand.
@@ -277,10 +367,18 @@ class GameReplay(models.Model):
 
 	visibility = IntEnumField(enum=Visibility, default=Visibility.Public)
 	hide_player_names = models.BooleanField(default=False)
+	updated = models.DateTimeField(auto_now=True)
+
+	objects = GameReplayManager()
 
 	def __str__(self):
 		return str(self.global_game)
 
+	def save(self, *args, **kwargs):
+		if self.match_start is None:
+			self.match_start = self.global_game.match_start
+		super(GameReplay, self).save(*args, **kwargs)
+
 	@property
 	def pretty_name(self):
 		players = self.global_game.players.values_list("player_id", "final_state", "name")
@@ -303,47 +401,32 @@ class GameReplay(models.Model):
 	def get_absolute_url(self):
 		return reverse("games_replay_view", kwargs={"id": self.shortid})
 
-	def update_final_states(self):
+	def update_final_states(self, final_state=None):
 		"""
 		Updates the replay's `won` and `disconnected` attributes
 		based on the final_state of its players.
+		The friendly player's final state is looked up unless it is passed.
 		"""
+		if final_state is None:
+			player = self.global_game.players.get(player_id=self.friendly_player_id)
+			final_state = player.final_state
+
 		# Record whether the user won/lost the game
-		player = self.global_game.players.get(player_id=self.friendly_player_id)
-		if player.final_state in (PlayState.PLAYING, PlayState.INVALID):
+		if final_state in (PlayState.PLAYING, PlayState.INVALID):
 			# This means we disconnected during the game
 			self.disconnected = True
-		elif player.final_state in (PlayState.WINNING, PlayState.WON):
+		elif final_state in (PlayState.WINNING, PlayState.WON):
 			self.won = True
 		else:
 			# Anything else is a concede/loss/tie
 			self.won = False
 
-	def save_hsreplay_xml(self, parser, meta):
-		from hsreplay.document import HSReplayDocument
-
-		global_game = self.global_game
-		hsreplay_doc = HSReplayDocument.from_parser(parser, build=global_game.build)
-		game_xml = hsreplay_doc.games[0]
-		game_xml.game_type = global_game.game_type
-		game_xml.id = global_game.game_server_game_id
-		if self.reconnecting:
-			game_xml.reconnecting = True
-
-		game_tree = parser.games[0]
-		for player in game_tree.game.players:
-			player_meta = meta.get("player%i" % (player.player_id), {})
-			player_xml = game_xml.players[player.player_id - 1]
-			player_xml.rank = player_meta.get("rank")
-			player_xml.legendRank = player_meta.get("legend_rank")
-			player_xml.cardback = player_meta.get("cardback")
-			player_xml.deck = player_meta.get("deck")
-
-		xml_str = hsreplay_doc.to_xml()
-		self.hsreplay_version = hsreplay_doc.version
-		# Clean up existing replays first
-		if self.replay_xml.name and default_storage.exists(self.replay_xml.name):
-			self.replay_xml.delete(save=False)
+	def write_hsreplay_xml(self, xml_str):
+		# Clean up existing replays once the new one is committed,
+		# so that a rolled back transaction doesn't lose it.
+		old_name = self.replay_xml.name
+		if old_name:
+			transaction.on_commit(lambda: default_storage.delete(old_name))
 		xml_file = ContentFile(xml_str)
 		self.replay_xml.save("hsreplay.xml", xml_file, save=False)
 
@@ -395,3 +478,36 @@ def claim_token_replays(sender, instance, **kwargs):
 			claim.replay.user = instance.user
 			claim.replay.save()
 		claims.delete()
+
+
+def invalidate_global_game_replays(global_game_id):
+	"""
+	Invalidates the cached replays of a global game and marks them as
+	modified, when the global game or its players change.
+	"""
+	replays = GameReplay.objects.filter(global_game_id=global_game_id)
+	shortids = list(replays.values_list("shortid", flat=True))
+	if shortids:
+		replays.update(updated=now())
+		transaction.on_commit(lambda: GameReplay.objects.invalidate_cache(shortids))
+
+
+@receiver(models.signals.post_save, sender=GameReplay)
+@receiver(models.signals.post_delete, sender=GameReplay)
+def invalidate_replay_cache(sender, instance, **kwargs):
+	# Invalidate after the commit, or a concurrent request could
+	# cache the replay again before its changes are visible.
+	shortid = instance.shortid
+	transaction.on_commit(lambda: GameReplay.objects.invalidate_cache([shortid]))
+
+
+@receiver(models.signals.post_save, sender=GlobalGame)
+def invalidate_global_game_cache(sender, instance, created, **kwargs):
+	if not created:
+		invalidate_global_game_replays(instance.id)
+
+
+@receiver(models.signals.post_save, sender=GlobalGamePlayer)
+@receiver(models.signals.post_delete, sender=GlobalGamePlayer)
+def invalidate_global_game_player_cache(sender, instance, **kwargs):
+	invalidate_global_game_replays(instance.game_id)
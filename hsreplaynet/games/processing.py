@@ -1,16 +1,24 @@
+import codecs
 import json
 import logging
 import traceback
-from io import StringIO
 from dateutil.parser import parse as dateutil_parse
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
 from hearthstone.enums import GameTag
 from hsreplay.dumper import parse_log
-from hsreplaynet.cards.models import Deck
-from hsreplaynet.utils import deduplication_time_range, guess_ladder_season
-from hsreplaynet.utils.instrumentation import influx_metric
-from hsreplaynet.uploads.models import UploadEventStatus
-from .models import GameReplay, GlobalGame, GlobalGamePlayer, PendingReplayOwnership
+from hsreplaynet.cards.models import Deck, deck_digest_cache
+from hsreplaynet.utils import (
+	deduplication_bucket, deduplication_buckets, deduplication_time_range,
+	guess_ladder_season, wall_clock
+)
+from hsreplaynet.utils.instrumentation import (
+	influx_cache_metric, influx_metric, influx_span, influx_trace
+)
+from hsreplaynet.uploads.models import UploadEventStatus, UploadEventType
+from .models import (
+	GameReplay, GlobalGame, GlobalGamePlayer, PendingReplayOwnership, generate_global_game_digest
+)
 
 
 logger = logging.getLogger(__file__)
@@ -32,12 +40,34 @@ def eligible_for_unification(meta):
 	return all([meta.get("game_id"), meta.get("client_id")])
 
 
-def find_or_create_global_game(game_tree, meta):
+def acquire_unification_lock(build, game_type, game_id, address, port):
+	"""
+	Serializes the unification of all uploads of the same game until the end
+	of the current transaction, using a PostgreSQL transaction-level advisory lock.
+	"""
+	if connection.vendor != "postgresql":
+		return
+
+	digest = generate_global_game_digest(build, game_type, game_id, address, port, None)
+	# Advisory lock keys are signed 64-bit integers
+	key = int(digest[:16], 16) - 2 ** 63
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+
+
+def get_build(meta):
 	build = meta["build"]
 	if build is None and "stats" in meta:
 		build = meta["stats"]["meta"]["build"]
+	return build
+
+
+@transaction.atomic
+def find_or_create_global_game(game_tree, meta):
+	build = get_build(meta)
 	game_id = meta.get("game_id")
 	game_type = meta.get("game_type", 0)
+	address, port = meta.get("server_ip"), meta.get("server_port")
 	start_time = game_tree.start_time
 	end_time = game_tree.end_time
 	if "stats" in meta and "ranked_season_stats" in meta["stats"]:
@@ -45,37 +75,66 @@ def find_or_create_global_game(game_tree, meta):
 	else:
 		ladder_season = guess_ladder_season(end_time)
 
-	global_game = None
+	digest = None
 	# Check if we have enough metadata to deduplicate the game
 	if eligible_for_unification(meta):
-		matches = GlobalGame.objects.filter(
-			build=build,
-			game_type=game_type,
-			game_server_game_id=game_id,
-			game_server_address=meta.get("server_ip"),
-			game_server_port=meta.get("server_port"),
+		# Uploads of the same game from both players can be processed concurrently.
+		# Hold the lock until the transaction commits so that only one creates the game.
+		acquire_unification_lock(build, game_type, game_id, address, port)
+		digests = [
+			generate_global_game_digest(build, game_type, game_id, address, port, bucket)
+			for bucket in deduplication_buckets(start_time)
+		]
+		matches = list(GlobalGame.objects.filter(
+			digest__in=digests,
 			match_start__range=deduplication_time_range(start_time),
-		)
+		))
 
 		if matches:
 			if len(matches) > 1:
 				# clearly something's up. invalidate the upload, look into it manually.
 				raise ValidationError("Found too many global games. Mumble mumble...")
-			return matches.first(), True
-
-	global_game = GlobalGame.objects.create(
-		game_server_game_id=game_id,
-		game_server_address=meta.get("server_ip"),
-		game_server_port=meta.get("server_port"),
-		game_type=game_type,
-		build=build,
-		match_start=start_time,
-		match_end=end_time,
-		ladder_season=ladder_season,
-		scenario_id=meta.get("scenario_id"),
-		num_entities=len(game_tree.game.entities),
-		num_turns=game_tree.game.tags.get(GameTag.TURN),
-	)
+			return matches[0], True
+
+		digest = generate_global_game_digest(
+			build, game_type, game_id, address, port, deduplication_bucket(start_time)
+		)
+
+	def create_global_game(digest):
+		return GlobalGame.objects.create(
+			game_server_game_id=game_id,
+			game_server_address=address,
+			game_server_port=port,
+			game_type=game_type,
+			build=build,
+			match_start=start_time,
+			match_end=end_time,
+			ladder_season=ladder_season,
+			scenario_id=meta.get("scenario_id"),
+			num_entities=len(game_tree.game.entities),
+			num_turns=game_tree.game.tags.get(GameTag.TURN),
+			digest=digest,
+		)
+
+	try:
+		with transaction.atomic():
+			global_game = create_global_game(digest)
+	except IntegrityError:
+		if digest is None:
+			raise
+		# The game was created concurrently by an upload which could not take
+		# the advisory lock (eg. not on PostgreSQL); use that one.
+		matches = GlobalGame.objects.filter(
+			digest=digest,
+			match_start__range=deduplication_time_range(start_time),
+		)
+		if matches:
+			return matches[0], True
+		# A game with the same digest which is too far away is a different game
+		# which the lookup above already rejected. The digest is taken, so this
+		# game can't be unified with later uploads.
+		logger.warning("Found a global game with digest %r too far away.", digest)
+		global_game = create_global_game(None)
 
 	return global_game, False
 
@@ -97,6 +156,7 @@ def find_or_create_replay(global_game, meta, unified):
 
 	replay = GameReplay(
 		global_game=global_game,
+		match_start=global_game.match_start,
 		friendly_player_id=meta["friendly_player"],
 		game_server_client_id=client_id,
 		game_server_spectate_key=meta.get("spectate_key"),
@@ -113,10 +173,12 @@ def process_upload_event(upload_event):
 	status and error/traceback as needed.
 	"""
 	upload_event.status = UploadEventStatus.PROCESSING
-	upload_event.save()
+	upload_event.save(update_fields=["status"])
 
 	try:
-		replay = do_process_upload_event(upload_event)
+		upload_type = UploadEventType(upload_event.type).name
+		with influx_trace("process_upload_event_span", upload_type=upload_type):
+			replay = do_process_upload_event(upload_event)
 	except Exception as e:
 		if isinstance(e, ParsingError):
 			upload_event.status = UploadEventStatus.PARSING_ERROR
@@ -126,26 +188,53 @@ def process_upload_event(upload_event):
 			upload_event.status = UploadEventStatus.SERVER_ERROR
 		upload_event.error = str(e)
 		upload_event.traceback = traceback.format_exc()
-		upload_event.save()
+		upload_event.save(update_fields=["status", "error", "traceback"])
 		raise
 	else:
 		upload_event.game = replay
 		upload_event.status = UploadEventStatus.SUCCESS
-		upload_event.save()
+		upload_event.save(update_fields=["game", "status"])
 
 	return replay
 
 
+def _iter_log_lines(file, stats):
+	"""
+	Yields the decoded lines of the file one by one, so that the whole
+	log never has to be held in memory at once.
+	The number of bytes read is accumulated in stats["num_bytes"].
+	"""
+	decoder = codecs.getincrementaldecoder("utf-8")()
+	for line in file:
+		stats["num_bytes"] += len(line)
+		yield decoder.decode(line)
+
+	tail = decoder.decode(b"", final=True)
+	if tail:
+		yield tail
+
+
 def parse_upload_event(upload_event, meta):
 	match_start = dateutil_parse(meta["match_start"])
-	upload_event.file.open(mode="rb")
-	log = StringIO(upload_event.file.read().decode("utf-8"))
-	upload_event.file.close()
+	stats = {"num_bytes": 0}
+	start_time = wall_clock()
 
+	# Compressed uploads are decompressed by the storage as they are read
+	upload_event.file.open(mode="rb")
 	try:
+		log = _iter_log_lines(upload_event.file, stats)
 		parser = parse_log(log, processor="GameState", date=match_start)
 	except Exception as e:
 		raise ParsingError(str(e))  # from e
+	finally:
+		upload_event.file.close()
+
+	duration = wall_clock() - start_time
+	influx_metric("parse_upload_event_throughput", {
+		"num_bytes": stats["num_bytes"],
+		"duration_ms": duration * 1000,
+		"bytes_per_sec": stats["num_bytes"] / duration if duration else 0,
+	})
 
 	return parser
 
@@ -178,6 +267,7 @@ def get_player_names(player):
 
 
 def create_global_players(global_game, game_tree, meta):
+	game_players = []
 	# Fill the player metadata and objects
 	for player in game_tree.game.players:
 		player_meta = meta.get("player%i" % (player.player_id), {})
@@ -209,45 +299,113 @@ def create_global_players(global_game, game_tree, meta):
 			final_state=final_state,
 			deck_list=deck,
 		)
+		game_players.append(game_player)
 
-		game_player.save()
+	GlobalGamePlayer.objects.bulk_create(game_players)
+	influx_cache_metric("deck_digest_cache", deck_digest_cache)
 
 
 def update_global_players(global_game, game_tree, meta):
 	logger.info("Unified upload. Updating players not implemented yet.")
 
 
+def get_final_state(game_tree, player_id):
+	for player in game_tree.game.players:
+		if player.player_id == player_id:
+			return player.tags.get(GameTag.PLAYSTATE, 0)
+
+
+def generate_hsreplay_xml(parser, meta):
+	"""
+	Returns the replay XML of the parsed game and its HSReplay version.
+	It only depends on the upload's metadata, not on the database.
+	"""
+	from hsreplay.document import HSReplayDocument
+
+	hsreplay_doc = HSReplayDocument.from_parser(parser, build=get_build(meta))
+	game_xml = hsreplay_doc.games[0]
+	game_xml.game_type = meta.get("game_type", 0)
+	game_xml.id = meta.get("game_id")
+	if meta.get("reconnecting", False):
+		game_xml.reconnecting = True
+
+	game_tree = parser.games[0]
+	for player in game_tree.game.players:
+		player_meta = meta.get("player%i" % (player.player_id), {})
+		player_xml = game_xml.players[player.player_id - 1]
+		player_xml.rank = player_meta.get("rank")
+		player_xml.legendRank = player_meta.get("legend_rank")
+		player_xml.cardback = player_meta.get("cardback")
+		player_xml.deck = player_meta.get("deck")
+
+	return hsreplay_doc.to_xml(), hsreplay_doc.version
+
+
 def do_process_upload_event(upload_event):
 	meta = json.loads(upload_event.metadata)
-	parser = parse_upload_event(upload_event, meta)
-	game_tree = validate_parser(parser, meta)
-	global_game, unified = find_or_create_global_game(game_tree, meta)
-	if upload_event.game:
-		replay, duplicate = upload_event.game, True
-	else:
-		replay, duplicate = find_or_create_replay(global_game, meta, unified)
+	with influx_span("parse"):
+		parser = parse_upload_event(upload_event, meta)
+	with influx_span("validate"):
+		game_tree = validate_parser(parser, meta)
+	# Exported before the transaction, so that it doesn't hold any locks
+	with influx_span("xml_export"):
+		xml_str, hsreplay_version = generate_hsreplay_xml(parser, meta)
+
+	# Everything from here on is written in a single transaction.
+	# This includes writing the replay XML to the storage: the unification
+	# lock and the uncommitted unique keys are held across that write, in
+	# exchange for never committing a replay whose XML failed to be written.
+	with influx_span("transaction"), transaction.atomic():
+		replay = save_upload_event_replay(
+			upload_event, game_tree, meta, xml_str, hsreplay_version
+		)
+
+	return replay
 
-	if unified or duplicate:
-		update_global_players(global_game, game_tree, meta)
-	else:
-		create_global_players(global_game, game_tree, meta)
 
-	user = upload_event.token.user if upload_event.token else None
-	if user and not replay.user:
+def save_upload_event_replay(upload_event, game_tree, meta, xml_str, hsreplay_version):
+	with influx_span("unify"):
+		global_game, unified = find_or_create_global_game(game_tree, meta)
+		if upload_event.game_id:
+			replay, duplicate = upload_event.game, True
+		else:
+			replay, duplicate = find_or_create_replay(global_game, meta, unified)
+
+	with influx_span("players", unified=unified or duplicate):
+		if unified or duplicate:
+			update_global_players(global_game, game_tree, meta)
+		else:
+			create_global_players(global_game, game_tree, meta)
+
+	token = upload_event.token
+	user = token.user if token else None
+	if user and not replay.user_id:
 		replay.user = user
 		replay.visibility = user.default_replay_visibility
 
-	# Create and save hsreplay.xml file
-	file = replay.save_hsreplay_xml(parser, meta)
+	# Save the hsreplay.xml file
+	replay.hsreplay_version = hsreplay_version
+	with influx_span("storage_write"):
+		file = replay.write_hsreplay_xml(xml_str)
 	influx_metric("replay_xml_num_bytes", {"size": file.size})
-	replay.update_final_states()
-	replay.save()
-
-	# Manual uploads (admin/command line) don't have tokens attached
-	if user is None and upload_event.token is not None:
-		# If the auth token has not yet been claimed, create
-		# a pending claim for the replay for when it will be.
-		claim = PendingReplayOwnership(replay=replay, token=upload_event.token)
-		claim.save()
+
+	try:
+		with influx_span("save"):
+			replay.update_final_states(get_final_state(game_tree, replay.friendly_player_id))
+			replay.save()
+
+			# Manual uploads (admin/command line) don't have tokens attached
+			if user is None and token is not None:
+				# If the auth token has not yet been claimed, create
+				# a pending claim for the replay for when it will be.
+				if duplicate:
+					PendingReplayOwnership.objects.get_or_create(replay=replay, defaults={"token": token})
+				else:
+					PendingReplayOwnership.objects.create(replay=replay, token=token)
+	except Exception:
+		# The transaction is rolled back, don't leave the new XML orphaned.
+		# (A failure of the commit itself still leaves it behind.)
+		replay.replay_xml.delete(save=False)
+		raise
 
 	return replay
@@ -0,0 +1,77 @@
+import json
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from hsreplaynet.cards.models import deck_digest_cache
+from hsreplaynet.games.models import GlobalGame, GlobalGamePlayer
+from hsreplaynet.games.processing import process_upload_event
+from hsreplaynet.test.base import TestDataConsumerMixin, create_agent_and_token
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+
+
+# Queries for processing a fresh, non-unified upload from an unclaimed token:
+# - 2 status updates of the upload event
+# - 2 savepoints and their releases around the processing transaction
+#   and the global game lookup, plus 3 for creating the global game
+# - 5 for each of the two decks: lookup, savepoint, deck, includes, release
+# - 1 each for the players, the replay and its pending claim
+# Any change to it should be a deliberate decision, not a side effect.
+PROCESSING_QUERIES = 22
+
+
+class ProcessUploadEventTests(TestDataConsumerMixin, TestCase):
+	@classmethod
+	def setUpClass(cls):
+		# Call `manage.py load_cards`
+		call_command("load_cards")
+		super().setUpClass()
+
+	def setUp(self):
+		deck_digest_cache.clear()
+		self.agent, self.token = create_agent_and_token()
+
+	def create_upload_event(self, **metadata):
+		fixture = self.get_raw_log_fixture_for_random_innkeeper_match()
+		metadata.update({
+			"build": 13740,
+			"match_start": fixture["match_start"].isoformat(),
+		})
+		upload_event = UploadEvent(
+			type=UploadEventType.POWER_LOG,
+			token=self.token,
+			api_key=self.agent,
+			upload_ip="127.0.0.1",
+			metadata=json.dumps(metadata),
+		)
+		upload_event.file.save("Power.log", ContentFile(fixture["raw_log"]), save=False)
+		upload_event.save()
+		return upload_event
+
+	def test_process_upload_event_num_queries(self):
+		upload_event = self.create_upload_event()
+
+		with CaptureQueriesContext(connection) as queries:
+			replay = process_upload_event(upload_event)
+
+		self.assertEqual(upload_event.status, UploadEventStatus.SUCCESS)
+		self.assertEqual(upload_event.game, replay)
+		self.assertEqual(replay.global_game.players.count(), 2)
+		self.assertEqual(len(queries), PROCESSING_QUERIES, "\n".join(
+			query["sql"] for query in queries.captured_queries
+		))
+
+	def test_process_upload_event_is_atomic(self):
+		# An unknown friendly player fails once the global game, its players
+		# and the replay XML are written, when looking up its final state.
+		upload_event = self.create_upload_event(friendly_player=3)
+
+		with self.assertRaises(GlobalGamePlayer.DoesNotExist):
+			process_upload_event(upload_event)
+
+		upload_event.refresh_from_db()
+		self.assertNotEqual(upload_event.status, UploadEventStatus.SUCCESS)
+		self.assertIsNone(upload_event.game_id)
+		self.assertFalse(GlobalGame.objects.exists())
+		self.assertFalse(GlobalGamePlayer.objects.exists())
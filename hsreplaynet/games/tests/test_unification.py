@@ -0,0 +1,121 @@
+import threading
+from datetime import datetime
+from io import StringIO
+from unittest import skipUnless
+import pytz
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from hearthstone.enums import GameTag
+from mock import MagicMock
+from hsreplaynet.games.models import GlobalGame
+from hsreplaynet.games.processing import find_or_create_global_game
+
+
+NUM_CONCURRENT_UPLOADS = 8
+
+
+def get_mock_game_tree(match_start=datetime(2016, 7, 14, 3, 0, 0, tzinfo=pytz.utc)):
+	game_tree = MagicMock()
+	game_tree.start_time = match_start
+	game_tree.end_time = match_start
+	game_tree.game.entities = [None] * 70
+	game_tree.game.tags = {GameTag.TURN: 6}
+	return game_tree
+
+
+META = {
+	"build": 12574,
+	"game_type": 2,
+	"game_id": 1234567,
+	"client_id": 42,
+	"server_ip": "12.130.244.193",
+	"server_port": 3724,
+}
+
+
+@skipUnless(connection.vendor == "postgresql", "Requires PostgreSQL advisory locks")
+class ConcurrentUnificationTest(TransactionTestCase):
+	def test_concurrent_uploads_create_one_global_game(self):
+		meta = META
+		barrier = threading.Barrier(NUM_CONCURRENT_UPLOADS)
+		results = []
+		errors = []
+
+		def upload():
+			try:
+				barrier.wait()
+				results.append(find_or_create_global_game(get_mock_game_tree(), dict(meta)))
+			except Exception as e:
+				errors.append(e)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=upload) for i in range(NUM_CONCURRENT_UPLOADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(GlobalGame.objects.count(), 1)
+		global_game = GlobalGame.objects.get()
+		self.assertEqual(set(game.id for game, unified in results), {global_game.id})
+		self.assertEqual(sum(1 for game, unified in results if not unified), 1)
+
+
+class UnificationTest(TestCase):
+	def create_global_game(self, match_start, **kwargs):
+		return GlobalGame.objects.create(
+			game_server_game_id=META["game_id"],
+			game_server_address=META["server_ip"],
+			game_server_port=META["server_port"],
+			game_type=META["game_type"],
+			build=META["build"],
+			match_start=match_start,
+			match_end=match_start,
+			num_entities=70,
+			num_turns=6,
+			**kwargs
+		)
+
+	def test_unification_across_bucket_boundary(self):
+		before = datetime(2016, 7, 14, 11, 59, 0, tzinfo=pytz.utc)
+		after = datetime(2016, 7, 14, 12, 1, 0, tzinfo=pytz.utc)
+		global_game, unified = find_or_create_global_game(get_mock_game_tree(before), dict(META))
+		self.assertFalse(unified)
+
+		game, unified = find_or_create_global_game(get_mock_game_tree(after), dict(META))
+		self.assertTrue(unified)
+		self.assertEqual(game, global_game)
+
+	def test_no_unification_outside_time_range(self):
+		before = datetime(2016, 7, 14, 0, 1, 0, tzinfo=pytz.utc)
+		after = datetime(2016, 7, 14, 11, 59, 0, tzinfo=pytz.utc)
+		global_game, unified = find_or_create_global_game(get_mock_game_tree(before), dict(META))
+
+		# Same bucket, hence the same digest, but too far away to be the same game
+		game, unified = find_or_create_global_game(get_mock_game_tree(after), dict(META))
+		self.assertFalse(unified)
+		self.assertNotEqual(game, global_game)
+		self.assertIsNone(game.digest)
+		self.assertEqual(GlobalGame.objects.count(), 2)
+
+	def test_backfill_global_game_digests(self):
+		match_start = datetime(2016, 7, 14, 3, 0, 0, tzinfo=pytz.utc)
+		game = self.create_global_game(match_start)
+		# Uploaded by the other player before unification used digests
+		duplicate = self.create_global_game(match_start)
+		not_eligible = self.create_global_game(match_start)
+		GlobalGame.objects.filter(id=not_eligible.id).update(game_server_game_id=None)
+
+		out = StringIO()
+		call_command("backfill_global_game_digests", stdout=out)
+
+		game.refresh_from_db()
+		duplicate.refresh_from_db()
+		not_eligible.refresh_from_db()
+		self.assertEqual(game.digest, game.generate_digest())
+		self.assertIsNone(duplicate.digest)
+		self.assertIsNone(not_eligible.digest)
+		self.assertIn("Duplicate of an existing GlobalGame: %r" % (duplicate.id), out.getvalue())
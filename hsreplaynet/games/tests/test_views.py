@@ -0,0 +1,158 @@
+from datetime import timedelta
+from mock import patch
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.http import http_date, parse_http_date
+from django.utils.timezone import now
+from hsreplaynet.games.models import REPLAY_PAGE_CACHE_TIMEOUT, GameReplay
+from hsreplaynet.games.views import MyReplaysView
+from hsreplaynet.test.base import ReplayFixtureMixin
+from hsreplaynet.utils.templatetags import web_extras
+
+
+class MyReplaysViewTests(ReplayFixtureMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.client.login(username="player", password="password")
+
+	def get_num_queries(self):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse("my_replays"))
+		self.assertEqual(response.status_code, 200)
+		return len(queries)
+
+	def test_num_queries_does_not_grow_with_replays(self):
+		self.create_replay(0)
+		num_queries = self.get_num_queries()
+
+		for i in range(1, 10):
+			self.create_replay(i)
+		self.assertEqual(self.get_num_queries(), num_queries)
+
+	@patch.object(MyReplaysView, "paginate_by", 3)
+	def test_keyset_pagination(self):
+		replays = [self.create_replay(i) for i in range(8)]
+		# Two replays of the same game share their match_start
+		replays.append(GameReplay.objects.create(
+			user=self.user, global_game=replays[-1].global_game, friendly_player_id=2
+		))
+		expected = [
+			r.shortid for r in sorted(replays, key=lambda r: (r.match_start, r.id), reverse=True)
+		]
+
+		shortids = []
+		params = {"format": "json"}
+		while True:
+			response = self.client.get(reverse("my_replays"), params)
+			self.assertEqual(response.status_code, 200)
+			data = response.json()
+			self.assertLessEqual(len(data["replays"]), 3)
+			shortids += [replay["shortid"] for replay in data["replays"]]
+			if not data["next"]:
+				break
+			params["cursor"] = data["next"]
+
+		self.assertEqual(shortids, expected)
+
+	def test_invalid_cursor(self):
+		response = self.client.get(reverse("my_replays"), {"cursor": "invalid"})
+		self.assertEqual(response.status_code, 400)
+		response = self.client.get(reverse("my_replays"), {"cursor": "%i_1" % (10 ** 20)})
+		self.assertEqual(response.status_code, 400)
+
+
+class ReplayDetailViewTests(ReplayFixtureMixin, TestCase):
+	def test_anonymous_page_is_cached(self):
+		replay = self.create_replay(0)
+		url = replay.get_absolute_url()
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+
+		with self.assertNumQueries(0):
+			cached_response = self.client.get(url)
+		self.assertEqual(cached_response.content, response.content)
+
+	def test_if_modified_since(self):
+		replay = self.create_replay(0)
+		url = replay.get_absolute_url()
+		response = self.client.get(url)
+		self.assertGreaterEqual(
+			parse_http_date(response["Last-Modified"]), int(replay.updated.timestamp())
+		)
+		self.assertIn("Cookie", response["Vary"])
+
+		response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+		self.assertEqual(response.status_code, 304)
+
+	def test_last_modified_expires_before_replay_urls(self):
+		replay = self.create_replay(0)
+		url = replay.get_absolute_url()
+		last_modified = self.client.get(url)["Last-Modified"]
+
+		later = now() + timedelta(seconds=REPLAY_PAGE_CACHE_TIMEOUT)
+		with patch("hsreplaynet.games.views.now", return_value=later):
+			response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+		self.assertEqual(response.status_code, 200)
+
+	def test_no_validators_for_authenticated_users(self):
+		replay = self.create_replay(0)
+		self.client.login(username="player", password="password")
+		response = self.client.get(replay.get_absolute_url(), HTTP_IF_MODIFIED_SINCE=http_date())
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(response.has_header("Last-Modified"))
+		self.assertIn("Cookie", response["Vary"])
+
+	def test_missing_replay(self):
+		response = self.client.get(reverse("games_replay_view", kwargs={"id": "missing"}))
+		self.assertEqual(response.status_code, 404)
+
+
+class ReplayCacheInvalidationTests(ReplayFixtureMixin, TransactionTestCase):
+	# Changes are committed, so the on_commit invalidation runs
+	def assertCacheMiss(self, url, text):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url)
+		self.assertNotEqual(len(queries), 0)
+		self.assertContains(response, text)
+
+	def test_player_change_invalidates_cache(self):
+		replay = self.create_replay(0)
+		url = replay.get_absolute_url()
+		self.assertEqual(self.client.get(url).status_code, 200)
+
+		player = replay.global_game.players.get(player_id=1)
+		player.rank = 20
+		player.save()
+		self.assertCacheMiss(url, "Rank 20")
+
+	def test_replay_change_invalidates_cache(self):
+		replay = self.create_replay(0)
+		url = replay.get_absolute_url()
+		self.assertEqual(self.client.get(url).status_code, 200)
+
+		replay.delete()
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 404)
+
+
+class FeaturedGameTests(ReplayFixtureMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		web_extras._featured_game.clear()
+
+	def test_featured_game_is_cached(self):
+		replay = self.create_replay(0)
+		with override_settings(FEATURED_GAME_ID=replay.shortid):
+			self.assertEqual(web_extras.get_featured_game(), replay)
+			with self.assertNumQueries(0):
+				featured_game = web_extras.get_featured_game()
+				self.assertEqual(featured_game, replay)
+				self.assertEqual(len(featured_game.global_game.players.all()), 2)
+
+	def test_missing_featured_game_is_cached(self):
+		with override_settings(FEATURED_GAME_ID="missing"):
+			self.assertIsNone(web_extras.get_featured_game())
+			with self.assertNumQueries(0):
+				self.assertIsNone(web_extras.get_featured_game())
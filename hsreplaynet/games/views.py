@@ -1,17 +1,151 @@
+from calendar import timegm
+from datetime import datetime, timedelta
+import pytz
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import get_object_or_404, render
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.timezone import now
 from django.views.generic import View
-from .models import GameReplay
+from .models import REPLAY_PAGE_CACHE_KEY, REPLAY_PAGE_CACHE_TIMEOUT, GameReplay
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def encode_replay_cursor(replay):
+	"""
+	Returns an opaque cursor pointing after `replay` in a listing ordered
+	by descending (match_start, id).
+	"""
+	delta = replay.match_start - EPOCH
+	timestamp = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+	return "%i_%i" % (timestamp, replay.id)
+
+
+def decode_replay_cursor(cursor):
+	"""
+	Returns the (match_start, id) of a cursor from encode_replay_cursor().
+	Raises ValueError or OverflowError if the cursor is invalid.
+	"""
+	timestamp, id = cursor.split("_")
+	return EPOCH + timedelta(microseconds=int(timestamp)), int(id)
+
+
+def get_replay_summary(replay):
+	global_game = replay.global_game
+	return {
+		"shortid": replay.shortid,
+		"url": replay.get_absolute_url(),
+		"match_start": replay.match_start.isoformat(),
+		"duration": global_game.duration.total_seconds(),
+		"num_own_turns": global_game.num_own_turns,
+		"won": replay.won,
+		"disconnected": replay.disconnected,
+		"is_tavern_brawl": global_game.is_tavern_brawl,
+		"players": [{
+			"name": player.name,
+			"hero_id": player.hero_id,
+			"won": player.won,
+		} for player in global_game.players.all()],
+	}
 
 
 class MyReplaysView(LoginRequiredMixin, View):
+	"""
+	Lists the user's replays, most recent first, `paginate_by` at a time.
+	Pages are selected with a keyset cursor on (match_start, id) so that
+	deep pages are as fast as the first one.
+	Returns JSON with ?format=json, for infinite scrolling.
+	"""
+	paginate_by = 36
+
 	def get(self, request):
-		replays = GameReplay.objects.filter(user=request.user)
-		context = {"replays": replays}
+		# Everything the replay cards show, in a constant number of queries
+		replays = GameReplay.objects.filter(user=request.user).select_related(
+			"global_game"
+		).prefetch_related("global_game__players").order_by("-match_start", "-id")
+
+		cursor = request.GET.get("cursor")
+		if cursor:
+			try:
+				match_start, id = decode_replay_cursor(cursor)
+			except (ValueError, OverflowError):
+				return HttpResponseBadRequest("Invalid cursor.")
+			replays = replays.filter(
+				Q(match_start__lt=match_start) | Q(match_start=match_start, id__lt=id)
+			)
+
+		# Fetch one more replay to know whether there is a next page
+		replays = list(replays[:self.paginate_by + 1])
+		if len(replays) > self.paginate_by:
+			replays = replays[:self.paginate_by]
+			next_cursor = encode_replay_cursor(replays[-1])
+		else:
+			next_cursor = None
+
+		if request.GET.get("format") == "json":
+			return JsonResponse({
+				"replays": [get_replay_summary(replay) for replay in replays],
+				"next": next_cursor,
+			})
+
+		context = {
+			"replays": replays,
+			"cursor": cursor,
+			"next_cursor": next_cursor,
+		}
 		return render(request, "games/my_replays.html", context)
 
 
+def get_replay_last_modified(replay):
+	"""
+	Returns the Last-Modified timestamp of an anonymous replay page.
+	The page embeds presigned replay XML URLs, which expire. The timestamp
+	moves forward every REPLAY_PAGE_CACHE_TIMEOUT seconds, so that browsers
+	revalidating the page get fresh URLs long before theirs expire.
+	"""
+	timestamp = timegm(now().utctimetuple())
+	timestamp -= timestamp % REPLAY_PAGE_CACHE_TIMEOUT
+	return max(timegm(replay.updated.utctimetuple()), timestamp)
+
+
 class ReplayDetailView(View):
+	"""
+	Replays are cached along with everything the page shows.
+	Pages rendered for anonymous users, who all see the same thing,
+	are cached as well, and support conditional requests.
+	"""
 	def get(self, request, id):
-		replay = get_object_or_404(GameReplay, shortid=id)
-		return render(request, "games/replay_detail.html", {"replay": replay})
+		try:
+			replay = GameReplay.objects.get_cached(id)
+		except GameReplay.DoesNotExist:
+			raise Http404("No such replay.")
+
+		# Pages of authenticated users show who they are,
+		# and pages with pending messages are not shared.
+		if request.user.is_authenticated() or get_messages(request):
+			response = render(request, "games/replay_detail.html", {"replay": replay})
+		else:
+			last_modified = get_replay_last_modified(replay)
+			response = get_conditional_response(request, last_modified=last_modified)
+			if response is None:
+				response = self.get_anonymous_response(request, replay)
+			response["Last-Modified"] = http_date(last_modified)
+
+		patch_vary_headers(response, ("Cookie", ))
+		return response
+
+	def get_anonymous_response(self, request, replay):
+		key = REPLAY_PAGE_CACHE_KEY % (replay.shortid)
+		content = cache.get(key)
+		if content is None:
+			response = render(request, "games/replay_detail.html", {"replay": replay})
+			cache.set(key, response.content, REPLAY_PAGE_CACHE_TIMEOUT)
+			return response
+
+		return HttpResponse(content)
@@ -0,0 +1,103 @@
+import json
+from base64 import b64encode
+from django.test import TransactionTestCase, override_settings
+from mock import patch
+from hsreplaynet.lambdas.uploads import (
+	create_power_log_upload_event_handler, process_upload_event_handler
+)
+from hsreplaynet.test.base import TestDataConsumerMixin, create_agent_and_token
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+
+
+# lambda_handler closes the DB connection, which a TestCase cannot survive
+@override_settings(UPLOAD_PROCESSING_BACKEND="workers")
+class CreateUploadEventHandlerTests(TestDataConsumerMixin, TransactionTestCase):
+	def setUp(self):
+		self.agent, self.token = create_agent_and_token()
+
+	def get_event(self, api_key=None):
+		return {
+			"path": "/api/v1/replay/upload/power_log",
+			"source_ip": "127.0.0.1",
+			"headers": {
+				"Authorization": "Token %s" % (self.token.key),
+				"X-Api-Key": api_key or str(self.agent.api_key),
+			},
+			"query": {
+				"build": "13740",
+				"match_start": "2016-07-14T03:00:00Z",
+			},
+			"body": b64encode(b"D 03:00:00.0000000 GameState.DebugPrintPower()").decode(),
+		}
+
+	def test_create_upload_event(self):
+		result = create_power_log_upload_event_handler(self.get_event(), self.get_mock_context())
+		self.assertEqual(result["result_type"], "SUCCESS")
+
+		upload = UploadEvent.objects.get()
+		self.assertEqual(upload.token, self.token)
+		self.assertEqual(upload.api_key, self.agent)
+		self.assertEqual(upload.status, UploadEventStatus.UNKNOWN)
+		self.assertEqual(json.loads(upload.metadata)["build"], 13740)
+		upload.file.delete(save=False)
+
+	def test_invalid_api_key(self):
+		event = self.get_event(api_key="00000000-0000-0000-0000-000000000000")
+		with self.assertRaises(Exception) as cm:
+			create_power_log_upload_event_handler(event, self.get_mock_context())
+
+		self.assertEqual(json.loads(str(cm.exception))["result_type"], "VALIDATION_ERROR")
+		self.assertFalse(UploadEvent.objects.exists())
+
+
+@patch.object(UploadEvent, "process", autospec=True)
+class ProcessUploadEventHandlerTests(TestDataConsumerMixin, TransactionTestCase):
+	def setUp(self):
+		self.agent, self.token = create_agent_and_token()
+		self.upload = UploadEvent.objects.create(
+			type=UploadEventType.POWER_LOG,
+			token=self.token,
+			api_key=self.agent,
+			upload_ip="127.0.0.1",
+			metadata="{}",
+		)
+
+	def get_message(self, id=None):
+		return json.dumps({"id": id or self.upload.id, "token": str(self.token.key)})
+
+	def test_sqs_batch_partial_failure(self, process):
+		event = {"Records": [
+			{"messageId": "processed", "body": self.get_message()},
+			{"messageId": "missing", "body": self.get_message(self.upload.id + 1)},
+			{"messageId": "malformed", "body": "{"},
+		]}
+		result = process_upload_event_handler(event, self.get_mock_context())
+
+		self.assertEqual(result["batchItemFailures"], [
+			{"itemIdentifier": "missing"}, {"itemIdentifier": "malformed"},
+		])
+		self.assertEqual(process.call_count, 1)
+		self.assertEqual(process.call_args[0][0], self.upload)
+
+	def test_sns_record_failure_is_raised(self, process):
+		event = {"Records": [
+			{"Sns": {"Message": self.get_message(self.upload.id + 1)}},
+		]}
+		with self.assertRaises(Exception):
+			process_upload_event_handler(event, self.get_mock_context())
+
+		self.assertFalse(process.called)
+
+	def test_sns_envelope_in_sqs_record(self, process):
+		envelope = {
+			"Type": "Notification",
+			"TopicArn": "arn:aws:sns:us-east-1:123456789012:process-upload-event",
+			"Message": self.get_message(),
+		}
+		event = {"Records": [
+			{"messageId": "processed", "body": json.dumps(envelope)},
+		]}
+		result = process_upload_event_handler(event, self.get_mock_context())
+
+		self.assertEqual(result["batchItemFailures"], [])
+		self.assertEqual(process.call_args[0][0], self.upload)
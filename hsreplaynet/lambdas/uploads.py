@@ -1,39 +1,35 @@
 import json
 import logging
-import tempfile
 from base64 import b64decode
-from django.contrib.sessions.middleware import SessionMiddleware
-from rest_framework.test import APIRequestFactory
-from hsreplaynet.api.views import UploadEventViewSet
+from django.core.files.base import ContentFile
+from django.utils.six.moves.urllib.parse import unquote_plus
+from rest_framework.exceptions import APIException, AuthenticationFailed, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from hsreplaynet.api.authentication import AuthTokenAuthentication
+from hsreplaynet.api.permissions import APIKeyPermission
+from hsreplaynet.api.serializers import UploadEventSerializer
 from hsreplaynet.uploads.models import UploadEvent, UploadEventType
+from hsreplaynet.uploads.presigned import queue_uploaded_file
 from hsreplaynet.uploads.processing import queue_upload_event_for_processing
 from hsreplaynet.utils import instrumentation
 
 
-def create_fake_api_request(event, body):
+def authenticate_upload_request(headers):
 	"""
-	Emulates an API request from the API gateway's data.
+	Returns the AuthToken and APIKey of an upload request from the
+	API gateway's headers, as the UploadEventViewSet would.
+	Raises an APIException if the request is not allowed.
 	"""
-	file = tempfile.NamedTemporaryFile(mode="r+b", suffix=".log")
-	file.write(body)
-	file.flush()
-	file.seek(0)
+	auth = headers.get("Authorization", "").split()
+	if len(auth) != 2 or auth[0].lower() != "token":
+		raise AuthenticationFailed("Invalid token header.")
+	user, token = AuthTokenAuthentication().authenticate_credentials(auth[1])
 
-	data = event["query"]
-	data["file"] = file
-	data["type"] = int(UploadEventType.POWER_LOG)
-
-	headers = event["headers"]
-	extra = {
-		"HTTP_X_FORWARDED_FOR": event["source_ip"],
-		"HTTP_AUTHORIZATION": headers["Authorization"],
-		"HTTP_X_API_KEY": headers["X-Api-Key"],
-	}
+	api_key = APIKeyPermission.get_api_key(headers.get(APIKeyPermission.HEADER_NAME, ""))
+	if api_key is None or not api_key.enabled:
+		raise PermissionDenied("Invalid API key.")
 
-	factory = APIRequestFactory()
-	request = factory.post(event["path"], data, **extra)
-	SessionMiddleware().process_request(request)
-	return request
+	return token, api_key
 
 
 @instrumentation.lambda_handler
@@ -49,14 +45,34 @@ def create_power_log_upload_event_handler(event, context):
 	body = b64decode(body)
 	instrumentation.influx_metric("raw_power_log_upload_num_bytes", {"size": len(body)})
 
-	request = create_fake_api_request(event, body)
-	view = UploadEventViewSet.as_view({"post": "create"})
-
 	try:
-		response = view(request)
-		response.render()
-		logger.info("Response (code=%r): %s" % (response.status_code, response.content))
+		token, api_key = authenticate_upload_request(event["headers"])
+	except APIException as e:
+		logger.info("Authentication failed: %s", e.detail)
+		raise Exception(json.dumps({
+			"result_type": "VALIDATION_ERROR",
+			"status_code": e.status_code,
+			"body": json.dumps({"detail": e.detail}),
+		}))
 
+	data = dict(event["query"])
+	data["file"] = ContentFile(body, name="power.log")
+	data["type"] = int(UploadEventType.POWER_LOG)
+	serializer = UploadEventSerializer(data=data)
+	if not serializer.is_valid():
+		logger.info("Validation failed: %r", serializer.errors)
+		raise Exception(json.dumps({
+			"result_type": "VALIDATION_ERROR",
+			"status_code": 400,
+			"body": json.dumps(serializer.errors),
+		}))
+
+	try:
+		upload_event = serializer.save(
+			token=token,
+			api_key=api_key,
+			upload_ip=event["source_ip"],
+		)
 	except Exception as e:
 		logger.exception(e)
 		raise Exception(json.dumps({
@@ -64,41 +80,79 @@ def create_power_log_upload_event_handler(event, context):
 			"body": str(e),
 		}))
 
-	if response.status_code != 201:
-		logger.info("")
-		result = {
-			"result_type": "VALIDATION_ERROR",
-			"status_code": response.status_code,
-			"body": response.content,
-		}
-		raise Exception(json.dumps(result))
-
-	# Extract the upload_event from the response and queue it for processing
-	upload_event_id = response.data["id"]
-	logger.info("Created UploadEvent %r", upload_event_id)
-	queue_upload_event_for_processing(upload_event_id)
+	logger.info("Created UploadEvent %r", upload_event.id)
+	queue_upload_event_for_processing(upload_event.id)
 
 	return {
 		"result_type": "SUCCESS",
-		"body": response.content,
+		"body": JSONRenderer().render(serializer.data),
 	}
 
 
+@instrumentation.lambda_handler
+def uploaded_file_notification_handler(event, context):
+	"""
+	This handler is triggered by the S3 event notifications of the
+	replay storage bucket whenever a client PUTs a file with a presigned URL.
+	The matching UploadEvents are queued for processing.
+	"""
+	logger = logging.getLogger("hsreplaynet.lambdas.upload_notifications")
+
+	for record in event["Records"]:
+		# Object keys are URL-encoded in event notifications
+		name = unquote_plus(record["s3"]["object"]["key"])
+		logger.info("File uploaded: %r", name)
+		queue_uploaded_file(name)
+
+
 @instrumentation.lambda_handler
 def process_upload_event_handler(event, context):
 	"""
 	This handler is triggered by SNS whenever someone
-	publishes a message to the SNS_PROCESS_UPLOAD_EVENT_TOPIC.
+	publishes a message to the SNS_PROCESS_UPLOAD_EVENT_TOPIC,
+	or by SQS with a batch of such messages.
+
+	Every record in the event is processed in turn, sharing the same
+	DB connection. A failing record does not prevent the others from
+	being processed; the SQS message IDs of the failed records are
+	returned so that only those get retried.
 	"""
 	logger = logging.getLogger("hsreplaynet.lambdas.upload_processing")
 
-	message = json.loads(event["Records"][0]["Sns"]["Message"])
-	logger.info("SNS message: %r", message)
+	records = event["Records"]
+	logger.info("Processing %i records", len(records))
+	failures = []
+
+	for record in records:
+		# SNS records have no SQS message ID; they are reported by UploadEvent ID
+		message_id = record.get("messageId")
+		try:
+			message = instrumentation.get_record_message(record)
+			logger.info("Message: %r", message)
+			if message_id is None:
+				message_id = message["id"]
+
+			# This should never raise DoesNotExist.
+			# If it does, the previous lambda made a terrible mistake.
+			upload = UploadEvent.objects.get(id=message["id"])
+
+			logger.info("Processing %r (%s)", upload.shortid, upload.status.name)
+			upload.process()
+			logger.info("Status: %s", upload.status.name)
+		except Exception as e:
+			instrumentation.error_handler(e)
+			failures.append(message_id)
+
+	instrumentation.influx_metric("process_upload_event_batch", {
+		"num_records": len(records),
+		"num_failures": len(failures),
+	})
+
+	if failures and len(records) == 1 and "Sns" in records[0]:
+		# Single SNS deliveries keep their original semantics:
+		# fail the invocation so that Lambda retries it.
+		raise Exception("Processing failed for %r" % (failures))
 
-	# This should never raise DoesNotExist.
-	# If it does, the previous lambda made a terrible mistake.
-	upload = UploadEvent.objects.get(id=message["id"])
-
-	logger.info("Processing %r (%s)", upload.shortid, upload.status.name)
-	upload.process()
-	logger.info("Status: %s", upload.status.name)
+	return {
+		"batchItemFailures": [{"itemIdentifier": id} for id in failures],
+	}
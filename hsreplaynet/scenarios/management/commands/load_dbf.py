@@ -2,7 +2,10 @@ import os
 from argparse import ArgumentTypeError
 from collections import OrderedDict
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
 from hearthstone.dbf import Dbf
+from hsreplaynet.utils.db import bulk_update
 from ...models import Adventure, Scenario, Wing
 
 
@@ -25,6 +28,7 @@ class Command(BaseCommand):
 		parser.add_argument("--build", type=build_range, required=True)
 		parser.add_argument("--force", action="store_true")
 		parser.add_argument("--locale", default="enUS")
+		parser.add_argument("--batch-size", type=int, default=500)
 
 	def get_values(self, record, columns):
 		values = {"build": self.build}
@@ -51,21 +55,37 @@ class Command(BaseCommand):
 			return
 
 		cls = self.tables[dbf.name]
+		existing = {instance.id: instance for instance in cls.objects.all()}
+		created, updated = [], []
+		updated_fields = set()
+		skipped = 0
+
 		for record in dbf.records:
 			values = self.get_values(record, cls.dbf_columns)
-			try:
-				instance = cls.objects.get(id=record["ID"])
-			except cls.DoesNotExist:
-				instance = cls.objects.create(**values)
-				self.stdout.write("Created %r (build %r)" % (instance, self.build))
+			instance = existing.get(record["ID"])
+			if instance is None:
+				created.append(cls(**values))
+			elif self.force or instance.build < self.build:
+				for k, v in values.items():
+					setattr(instance, k, v)
+				updated_fields.update(values)
+				updated.append(instance)
 			else:
-				if self.force or instance.build < self.build:
-					self.stdout.write("Updating %r to build %r" % (instance, self.build))
-					for k, v in values.items():
-						setattr(instance, k, v)
-					instance.save()
-				else:
-					self.stdout.write("Skipping %r (up to date)" % (instance))
+				skipped += 1
+
+		cls.objects.bulk_create(created, batch_size=self.batch_size)
+		if updated:
+			# auto_now is not applied by queryset updates
+			timestamp = now()
+			for instance in updated:
+				instance.updated = timestamp
+			updated_fields.discard("id")
+			updated_fields.add("updated")
+			bulk_update(cls, updated, sorted(updated_fields), batch_size=self.batch_size)
+
+		self.stdout.write("%s: %i created, %i updated to build %r, %i up to date" % (
+			dbf.name, len(created), len(updated), self.build, skipped
+		))
 
 	def load_dbf_folder(self, path):
 		for dbf_name in self.tables:
@@ -77,8 +97,13 @@ class Command(BaseCommand):
 		self.build = options["build"]
 		self.force = options["force"]
 		self.locale = options["locale"]
+		self.batch_size = options["batch_size"]
 
-		if os.path.isdir(path):
-			self.load_dbf_folder(path)
-		else:
-			self.load_dbf(path)
+		# Everything is loaded in a single transaction. The tables are loaded in
+		# FK order (Adventure, Wing, Scenario) and FK constraints are only checked
+		# at commit, so rows may reference rows created in the same batch.
+		with transaction.atomic():
+			if os.path.isdir(path):
+				self.load_dbf_folder(path)
+			else:
+				self.load_dbf(path)
@@ -104,8 +104,17 @@ STATICFILES_DIRS = [
 	os.path.join(BASE_DIR, "hsreplaynet", "static"),
 ]
 
+# Stored files with these content types are gzipped (and get a ".gz"
+# suffix on the filesystem). Replay XML and raw logs compress very well.
+GZIP_CONTENT_TYPES = (
+	"text/xml",
+	"text/plain",
+	"application/xml",
+	"application/octet-stream",
+)
+
 if DEBUG:
-	DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
+	DEFAULT_FILE_STORAGE = "hsreplaynet.utils.storage.GzipFileSystemStorage"
 	STATIC_URL = "/static/"
 else:
 	DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
@@ -127,12 +136,6 @@ else:
 	AWS_DEFAULT_ACL = "private"
 
 	AWS_IS_GZIPPED = True
-	GZIP_CONTENT_TYPES = (
-		"text/xml",
-		"text/plain",
-		"application/xml",
-		"application/octet-stream",
-	)
 
 JOUST_STATIC_URL = STATIC_URL + "joust/"
 HEARTHSTONEJSON_URL = "https://cdn.hearthstonejson.com/v1/%(build)s/%(locale)s/cards.json"
@@ -161,6 +164,33 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Cached data such as the card DB version or replays is invalidated by whichever
+# process changes it (eg. `manage.py load_cards`, upload processing on Lambda),
+# so every process has to share the cache. The database cache is shared by all
+# of them, web and Lambda alike; its table is created with
+# `manage.py createcachetable` on deploy and on Lambda startup.
+# The local memory cache is per-process and only suitable for development.
+
+if IS_RUNNING_LIVE or IS_RUNNING_AS_LAMBDA:
+	CACHES = {
+		"default": {
+			"BACKEND": "django.core.cache.backends.db.DatabaseCache",
+			"LOCATION": "django_cache",
+			"OPTIONS": {
+				"MAX_ENTRIES": 100000,
+			},
+		}
+	}
+else:
+	CACHES = {
+		"default": {
+			"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+		}
+	}
+
+
 # Logging
 
 
@@ -206,6 +236,17 @@ REST_FRAMEWORK = {
 }
 
 
+# Upload processing
+# How newly created UploadEvents get processed:
+# - "sns": Published to SNS_PROCESS_UPLOAD_EVENT_TOPIC and processed on Lambda
+# - "inline": Processed right away, in the thread that created them
+# - "workers": Left pending for the `manage.py run_upload_workers` pool
+if IS_RUNNING_LIVE or IS_RUNNING_AS_LAMBDA:
+	UPLOAD_PROCESSING_BACKEND = "sns"
+else:
+	UPLOAD_PROCESSING_BACKEND = "inline"
+
+
 # Custom site settings
 
 # HDT_DOWNLOAD_URL = "https://hsdecktracker.net"
@@ -2,11 +2,15 @@ import json
 import os
 import subprocess
 import pytz
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
+from django.contrib.auth import get_user_model
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from django.core.cache import cache
 from selenium import webdriver
 from hearthstone.enums import *
 from hsreplaynet.api.models import AuthToken, APIKey
+from hsreplaynet.cards.models import Card, Deck
+from hsreplaynet.games.models import GameReplay, GlobalGame, GlobalGamePlayer
 from mock import MagicMock
 
 
@@ -125,6 +129,54 @@ class TestDataConsumerMixin:
 		return fixture
 
 
+class ReplayFixtureMixin:
+	"""
+	A mixin class for creating replays of two player games, won by player 1,
+	owned by the "player" user (password "password").
+	"""
+
+	def setUp(self):
+		super().setUp()
+		# Replays are cached
+		cache.clear()
+		self.user = get_user_model().objects.create_user("player", password="password")
+		self.deck = Deck.objects.create()
+		heroes = (("HERO_01", "Garrosh Hellscream"), ("HERO_08", "Jaina Proudmoore"))
+		# The cards may have been loaded already (`manage.py load_cards`)
+		self.heroes = [
+			Card.objects.get_or_create(id=id, defaults={"name": name, "type": CardType.HERO})[0]
+			for id, name in heroes
+		]
+		self.match_start = datetime(2016, 7, 14, 3, 0, 0, tzinfo=pytz.utc)
+
+	def create_replay(self, i, **kwargs):
+		"""
+		Creates a replay of a game starting `i` hours after self.match_start.
+		"""
+		match_start = self.match_start + timedelta(hours=i)
+		global_game = GlobalGame.objects.create(
+			match_start=match_start,
+			match_end=match_start + timedelta(minutes=10),
+			num_turns=10,
+			num_entities=70,
+		)
+		for player_id, hero in enumerate(self.heroes, 1):
+			GlobalGamePlayer.objects.create(
+				game=global_game,
+				player_id=player_id,
+				name="Player %i" % (player_id),
+				is_first=player_id == 1,
+				hero=hero,
+				deck_list=self.deck,
+				final_state=PlayState.WON if player_id == 1 else PlayState.LOST,
+			)
+		kwargs.setdefault("user", self.user)
+		kwargs.setdefault("friendly_player_id", 1)
+		# Only the URL of the replay XML is ever needed
+		kwargs.setdefault("replay_xml", "replays/%i.hsreplay.xml" % (i))
+		return GameReplay.objects.create(global_game=global_game, **kwargs)
+
+
 def create_agent_and_token():
 	agent = APIKey.objects.create(
 		full_name="Test API Key",
@@ -0,0 +1,61 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from hsreplaynet.uploads.models import UploadEvent, UploadEventType
+from hsreplaynet.utils import aware_datetime, iter_ids
+from hsreplaynet.utils.storage import is_gzipped
+
+
+class Command(BaseCommand):
+	help = "Compresses the stored files of UploadEvents which were saved uncompressed."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--created-after", type=aware_datetime)
+		parser.add_argument("--created-before", type=aware_datetime)
+		parser.add_argument("--chunk-size", type=int, default=1000)
+		parser.add_argument(
+			"--dry-run", action="store_true",
+			help="Only report the uploads which would be compressed"
+		)
+
+	def handle(self, *args, **options):
+		queryset = UploadEvent.objects.exclude(file="")
+		if options["created_after"]:
+			queryset = queryset.filter(created__gte=options["created_after"])
+		if options["created_before"]:
+			queryset = queryset.filter(created__lt=options["created_before"])
+
+		compressed, skipped = 0, 0
+		bytes_before, bytes_after = 0, 0
+		for id in iter_ids(queryset, options["chunk_size"]):
+			upload_event = UploadEvent.objects.only("id", "type", "file").get(id=id)
+			name = upload_event.file.name
+			if not default_storage.exists(name) or is_gzipped(default_storage, name):
+				skipped += 1
+				continue
+
+			bytes_before += default_storage.size(name)
+			if options["dry_run"]:
+				compressed += 1
+				continue
+
+			with default_storage.open(name, "rb") as f:
+				content = File(f)
+				# The storage compresses files based on their content type
+				content.content_type = UploadEventType(upload_event.type).content_type
+				new_name = default_storage.save(name, content)
+
+			if new_name != name:
+				# The filesystem storage adds a .gz suffix; S3 overwrites in place.
+				UploadEvent.objects.filter(id=id).update(file=new_name)
+				default_storage.delete(name)
+			bytes_after += default_storage.size(new_name)
+			compressed += 1
+
+		self.stdout.write("%i uploads compressed, %i skipped" % (compressed, skipped))
+		if bytes_after:
+			self.stdout.write("%i bytes -> %i bytes (%.1fx)" % (
+				bytes_before, bytes_after, bytes_before / bytes_after
+			))
+		elif bytes_before:
+			self.stdout.write("%i bytes to compress" % (bytes_before))
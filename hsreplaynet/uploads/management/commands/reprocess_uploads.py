@@ -0,0 +1,99 @@
+import time
+from collections import Counter
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus
+from hsreplaynet.uploads.processing import (
+	process_upload_event_by_id, queue_upload_event_for_processing
+)
+from hsreplaynet.utils import aware_datetime, iter_ids
+
+
+def status_name(value):
+	try:
+		return UploadEventStatus[value.upper()]
+	except KeyError:
+		raise CommandError("Invalid status: %r" % (value))
+
+
+class Command(BaseCommand):
+	help = "Reprocesses UploadEvents matching the given filters."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--status", type=status_name, action="append", default=[],
+			help="Only reprocess UploadEvents with this status (eg. PARSING_ERROR). Repeatable."
+		)
+		parser.add_argument("--created-after", type=aware_datetime)
+		parser.add_argument("--created-before", type=aware_datetime)
+		parser.add_argument("--api-key", help="Only reprocess uploads made with this API Key")
+		parser.add_argument("--build", type=int, help="Only reprocess uploads of this build")
+		parser.add_argument(
+			"--processes", type=int, default=4,
+			help="Number of worker processes (or publishing threads with --queue)"
+		)
+		parser.add_argument(
+			"--queue", action="store_true",
+			help="Queue the uploads through the processing backend instead of processing them here"
+		)
+		parser.add_argument("--chunk-size", type=int, default=1000)
+		parser.add_argument("--report-interval", type=float, default=5.0)
+
+	def get_queryset(self, options):
+		queryset = UploadEvent.objects.all()
+		if options["status"]:
+			queryset = queryset.filter(status__in=options["status"])
+		if options["created_after"]:
+			queryset = queryset.filter(created__gte=options["created_after"])
+		if options["created_before"]:
+			queryset = queryset.filter(created__lt=options["created_before"])
+		if options["api_key"]:
+			queryset = queryset.filter(api_key__api_key=options["api_key"])
+		if options["build"] is not None:
+			# The build is only stored in the JSON-encoded metadata
+			queryset = queryset.filter(metadata__regex=r'"build": %i[,}]' % (options["build"]))
+		return queryset
+
+	def report(self, counts, total, start_time):
+		done = sum(counts.values())
+		elapsed = time.time() - start_time
+		rate = done / elapsed if elapsed else 0
+		eta = (total - done) / rate if rate else 0
+		statuses = ", ".join("%s=%i" % (k, v) for k, v in sorted(counts.items()))
+		self.stdout.write("%i/%i (%.1f/s, ETA %is) %s" % (done, total, rate, eta, statuses))
+
+	def handle(self, *args, **options):
+		queryset = self.get_queryset(options)
+		total = queryset.count()
+		self.stdout.write("%i UploadEvents to reprocess" % (total))
+		if not total:
+			return
+
+		ids = iter_ids(queryset, options["chunk_size"])
+		if options["queue"]:
+			pool = ThreadPool(options["processes"])
+			results = pool.imap_unordered(self.queue, ids)
+		else:
+			# Forked workers must not share the parent's connections
+			connections.close_all()
+			pool = Pool(options["processes"], initializer=connections.close_all)
+			results = pool.imap_unordered(process_upload_event_by_id, ids)
+
+		counts = Counter()
+		start_time = last_report = time.time()
+		try:
+			for status in results:
+				counts[status.name if status is not None else "DELETED"] += 1
+				if time.time() - last_report >= options["report_interval"]:
+					self.report(counts, total, start_time)
+					last_report = time.time()
+		finally:
+			pool.terminate()
+
+		self.report(counts, total, start_time)
+
+	def queue(self, id):
+		queue_upload_event_for_processing(id)
+		return UploadEventStatus.UNKNOWN
@@ -0,0 +1,80 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from hsreplaynet.uploads.processing import (
+	claim_pending_upload_events, process_upload_event_by_id
+)
+
+
+def run_worker(counter, batch_size, poll_interval, exit_when_idle):
+	# Connections inherited from the parent process must not be shared
+	connections.close_all()
+
+	while True:
+		ids = claim_pending_upload_events(batch_size)
+		if not ids:
+			if exit_when_idle:
+				return
+			time.sleep(poll_interval)
+			continue
+
+		for id in ids:
+			process_upload_event_by_id(id)
+			with counter.get_lock():
+				counter.value += 1
+
+
+class Command(BaseCommand):
+	help = "Processes pending UploadEvents with a pool of local worker processes."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--concurrency", type=int, default=multiprocessing.cpu_count(),
+			help="Number of worker processes (default: number of CPUs)"
+		)
+		parser.add_argument(
+			"--batch-size", type=int, default=1,
+			help="Number of UploadEvents claimed by a worker at once"
+		)
+		parser.add_argument(
+			"--poll-interval", type=float, default=1.0,
+			help="Seconds to wait before polling again when nothing is pending"
+		)
+		parser.add_argument(
+			"--exit-when-idle", action="store_true",
+			help="Stop once no pending UploadEvents remain (eg. for benchmarking)"
+		)
+
+	def handle(self, *args, **options):
+		concurrency = options["concurrency"]
+		counter = multiprocessing.Value("i", 0)
+		worker_args = (
+			counter, options["batch_size"], options["poll_interval"], options["exit_when_idle"]
+		)
+
+		# The workers open their own connections after forking
+		connections.close_all()
+
+		self.stdout.write("Starting %i upload workers" % (concurrency))
+		start_time = time.time()
+		workers = [
+			multiprocessing.Process(target=run_worker, args=worker_args)
+			for i in range(concurrency)
+		]
+		for worker in workers:
+			worker.start()
+
+		try:
+			for worker in workers:
+				worker.join()
+		except KeyboardInterrupt:
+			self.stdout.write("Interrupted, stopping workers")
+			for worker in workers:
+				worker.terminate()
+				worker.join()
+
+		duration = time.time() - start_time
+		self.stdout.write("Processed %i uploads in %.2fs (%.2f uploads/s)" % (
+			counter.value, duration, counter.value / duration
+		))
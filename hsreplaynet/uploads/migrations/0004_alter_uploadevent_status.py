@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import hsreplaynet.uploads.models
+import hsreplaynet.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0003_uploadevent_api_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadevent',
+            name='status',
+            field=hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'UNKNOWN'), (1, 'PROCESSING'), (2, 'SERVER_ERROR'), (3, 'PARSING_ERROR'), (4, 'SUCCESS'), (5, 'UNSUPPORTED'), (6, 'PENDING_UPLOAD')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hsreplaynet.uploads.models.UploadEventStatus)]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_pending_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        # Only pending rows are ever looked up by status
+        schema_editor.execute(
+            "CREATE INDEX uploads_uploadevent_pending ON uploads_uploadevent (id) "
+            "WHERE status IN (0, 1)"
+        )
+    else:
+        schema_editor.execute(
+            "CREATE INDEX uploads_uploadevent_pending ON uploads_uploadevent (status, id)"
+        )
+
+
+def drop_pending_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "mysql":
+        schema_editor.execute("DROP INDEX uploads_uploadevent_pending ON uploads_uploadevent")
+    else:
+        schema_editor.execute("DROP INDEX uploads_uploadevent_pending")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0004_alter_uploadevent_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadevent',
+            name='claimed',
+            field=models.DateTimeField(blank=True, help_text='When the UploadEvent was last claimed by an upload worker', null=True),
+        ),
+        migrations.RunPython(create_pending_index, drop_pending_index),
+    ]
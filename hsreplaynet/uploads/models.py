@@ -1,4 +1,7 @@
+import json
 from enum import IntEnum
+import shortuuid
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.dispatch.dispatcher import receiver
@@ -22,6 +25,12 @@ class UploadEventType(IntEnum):
 			return ".hsreplay.xml"
 		return ".txt"
 
+	@property
+	def content_type(self):
+		if self.name == "HSREPLAY_XML":
+			return "application/xml"
+		return "text/plain"
+
 
 class UploadEventStatus(IntEnum):
 	UNKNOWN = 0
@@ -30,17 +39,52 @@ class UploadEventStatus(IntEnum):
 	PARSING_ERROR = 3
 	SUCCESS = 4
 	UNSUPPORTED = 5
+	PENDING_UPLOAD = 6
 
 
-def _generate_upload_path(instance, filename):
-	ts = now()
+def _get_upload_path(instance, ts, basename):
 	extension = UploadEventType(instance.type).extension
 	if instance.token_id:
 		token = str(instance.token_id)
 	else:
 		token = "unknown-token"
 	yymmdd = ts.strftime("%Y/%m/%d")
-	return "uploads/%s/%s/%s%s" % (yymmdd, token, ts.isoformat(), extension)
+	return "uploads/%s/%s/%s%s" % (yymmdd, token, basename, extension)
+
+
+def _generate_upload_path(instance, filename):
+	ts = now()
+	return _get_upload_path(instance, ts, ts.isoformat())
+
+
+def generate_direct_upload_path(instance):
+	"""
+	Returns the storage path of a file uploaded directly to the storage.
+	It ends with the UploadEvent's shortid so that storage notifications
+	can be matched back to their UploadEvent (see uploads.presigned).
+	"""
+	return _get_upload_path(instance, now(), instance.shortid)
+
+
+class UploadEventManager(models.Manager):
+	def create_from_metadata(self, type, metadata, upload_ip, token=None, api_key=None, file=None):
+		"""
+		Creates an UploadEvent from validated upload metadata
+		(see api.serializers.UploadEventSerializer) and its file.
+		Without a file, the UploadEvent is left PENDING_UPLOAD until
+		the file is uploaded directly to the storage.
+		"""
+		ret = UploadEvent(type=type, token=token, api_key=api_key, upload_ip=upload_ip)
+		ret.metadata = json.dumps(metadata, cls=DjangoJSONEncoder)
+		if file is None:
+			ret.shortid = shortuuid.uuid()
+			ret.status = UploadEventStatus.PENDING_UPLOAD
+			ret.file.name = generate_direct_upload_path(ret)
+		else:
+			ret.file = file
+		ret.save()
+
+		return ret
 
 
 class UploadEvent(models.Model):
@@ -68,6 +112,10 @@ class UploadEvent(models.Model):
 	created = models.DateTimeField(auto_now_add=True)
 	upload_ip = models.GenericIPAddressField()
 	status = IntEnumField(enum=UploadEventStatus, default=UploadEventStatus.UNKNOWN)
+	claimed = models.DateTimeField(
+		null=True, blank=True,
+		help_text="When the UploadEvent was last claimed by an upload worker"
+	)
 	tainted = models.BooleanField(default=False)
 	error = models.TextField(blank=True)
 	traceback = models.TextField(blank=True)
@@ -75,12 +123,18 @@ class UploadEvent(models.Model):
 	metadata = models.TextField()
 	file = models.FileField(upload_to=_generate_upload_path)
 
+	objects = UploadEventManager()
+
 	def __str__(self):
 		return self.shortid
 
 	@property
 	def is_processing(self):
-		return self.status in (UploadEventStatus.UNKNOWN, UploadEventStatus.PROCESSING)
+		return self.status in (
+			UploadEventStatus.UNKNOWN,
+			UploadEventStatus.PROCESSING,
+			UploadEventStatus.PENDING_UPLOAD,
+		)
 
 	def get_absolute_url(self):
 		return reverse("upload_detail", kwargs={"shortid": self.shortid})
@@ -91,6 +145,15 @@ class UploadEvent(models.Model):
 		process_upload_event(self)
 
 
+@receiver(models.signals.pre_save, sender=UploadEvent)
+def set_uploaded_log_content_type(sender, instance, **kwargs):
+	# The storage compresses files based on their content type, which
+	# would otherwise be whatever the client sent along with the upload.
+	file = instance.file
+	if file and not file._committed:
+		file.file.content_type = UploadEventType(instance.type).content_type
+
+
 @receiver(models.signals.post_delete, sender=UploadEvent)
 def cleanup_uploaded_log_file(sender, instance, **kwargs):
 	file = instance.file
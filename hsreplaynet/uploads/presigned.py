@@ -0,0 +1,82 @@
+"""
+Direct-to-storage uploads.
+
+Clients first create an UploadEvent without a file (PENDING_UPLOAD) and
+get a presigned URL back, then PUT the log straight to the storage.
+Processing is triggered once the storage reports the file:
+by the S3 event notification Lambda on S3, or by the signed upload view
+standing in for S3 with any other storage.
+"""
+import logging
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+from hsreplaynet.uploads.processing import queue_upload_event_for_processing
+
+
+logger = logging.getLogger(__file__)
+PUT_URL_EXPIRES_IN = getattr(settings, "UPLOAD_PUT_URL_EXPIRES_IN", 3600)
+PUT_URL_SIGNING_SALT = "hsreplaynet.uploads.put"
+
+
+def get_shortid_from_path(name):
+	return name.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+def generate_put_url(upload_event, request):
+	"""
+	Returns a URL the client can PUT the UploadEvent's file to.
+	On S3, the body must be gzipped and sent with `Content-Encoding: gzip`,
+	which is part of the signature: raw uploads are always stored compressed.
+	"""
+	bucket = getattr(default_storage, "bucket", None)
+	if bucket is None:
+		signature = signing.dumps(upload_event.shortid, salt=PUT_URL_SIGNING_SALT)
+		url = reverse("upload_put", kwargs={"signature": signature})
+		return request.build_absolute_uri(url)
+
+	key = default_storage._normalize_name(default_storage._clean_name(upload_event.file.name))
+	return bucket.meta.client.generate_presigned_url(
+		"put_object",
+		Params={
+			"Bucket": bucket.name,
+			"Key": key,
+			"ContentType": UploadEventType(upload_event.type).content_type,
+			"ContentEncoding": "gzip",
+		},
+		ExpiresIn=PUT_URL_EXPIRES_IN,
+	)
+
+
+def get_put_url_shortid(signature):
+	"""
+	Returns the shortid of the UploadEvent a signed upload URL is for.
+	Raises signing.BadSignature if the signature is invalid or expired.
+	"""
+	return signing.loads(signature, salt=PUT_URL_SIGNING_SALT, max_age=PUT_URL_EXPIRES_IN)
+
+
+def queue_uploaded_file(name):
+	"""
+	Queues the UploadEvent of a file which was uploaded to the storage
+	at `name` for processing.
+	Returns whether the file matched an UploadEvent waiting for it;
+	notifications for files which were already received are ignored.
+	"""
+	shortid = get_shortid_from_path(name)
+	upload_event = UploadEvent.objects.filter(shortid=shortid).only("id").first()
+	if upload_event is None:
+		logger.warning("No UploadEvent for uploaded file %r", name)
+		return False
+
+	updated = UploadEvent.objects.filter(
+		id=upload_event.id, status=UploadEventStatus.PENDING_UPLOAD
+	).update(file=name, status=UploadEventStatus.UNKNOWN)
+	if not updated:
+		logger.info("UploadEvent %r is not waiting for its file, ignoring %r", shortid, name)
+		return False
+
+	queue_upload_event_for_processing(upload_event.id)
+	return True
@@ -7,16 +7,22 @@ http://boto3.readthedocs.io/en/latest/reference/services/sns.html#SNS.Client.pub
 import json
 import logging
 import os
+from datetime import timedelta
 import boto3
 from django.conf import settings
+from django.db import connection, transaction
 from django.utils.timezone import now
-from hsreplaynet.uploads.models import UploadEvent
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus
 from hsreplaynet.utils.instrumentation import error_handler, influx_metric
 
 
 logger = logging.getLogger(__file__)
 _sns_client = None
 
+# Seconds after which an UploadEvent claimed by a worker which never
+# finished processing it (eg. the worker died) can be claimed again.
+UPLOAD_CLAIM_TIMEOUT = getattr(settings, "UPLOAD_CLAIM_TIMEOUT", 15 * 60)
+
 
 def sns_client():
 	global _sns_client
@@ -25,49 +31,126 @@ def sns_client():
 	return _sns_client
 
 
+def publish_upload_event_to_sns(upload_event_id):
+	if "TRACING_REQUEST_ID" in os.environ:
+		token = os.environ["TRACING_REQUEST_ID"]
+	else:
+		# If this was re-queued manually the tracing ID may not be set yet.
+		event = UploadEvent.objects.get(id=upload_event_id)
+		token = str(event.token_id)
+
+	message = {
+		"id": upload_event_id,
+		"token": token,
+	}
+
+	success = True
+	try:
+		logger.info("Submitting %r to SNS", message)
+		response = sns_client().publish(
+			TopicArn=settings.SNS_PROCESS_UPLOAD_EVENT_TOPIC,
+			Message=json.dumps({"default": json.dumps(message)}),
+			MessageStructure="json"
+		)
+		logger.info("SNS Response: %s" % str(response))
+	except Exception as e:
+		logger.error("Exception raised.")
+		error_handler(e)
+		success = False
+	finally:
+		influx_metric(
+			"queue_upload_event_for_processing",
+			fields={"value": 1},
+			timestamp=now(),
+			tags={
+				"success": success,
+				"is_running_as_lambda": settings.IS_RUNNING_AS_LAMBDA,
+			}
+		)
+
+
+def process_upload_event_inline(upload_event_id):
+	logger.info("Processing UploadEvent %r locally", upload_event_id)
+	upload = UploadEvent.objects.get(id=upload_event_id)
+	upload.process()
+
+
+def leave_upload_event_for_workers(upload_event_id):
+	logger.info("UploadEvent %r left pending for the upload workers", upload_event_id)
+	# Reset the status, in case the UploadEvent is being requeued
+	UploadEvent.objects.filter(id=upload_event_id).update(status=UploadEventStatus.UNKNOWN)
+
+
+PROCESSING_BACKENDS = {
+	"sns": publish_upload_event_to_sns,
+	"inline": process_upload_event_inline,
+	"workers": leave_upload_event_for_workers,
+}
+
+
 def queue_upload_event_for_processing(upload_event_id):
 	"""
 	This method is used when UploadEvents are initially created.
 	However it can also be used to requeue an UploadEvent to be
 	processed again if an error was detected downstream that has now been fixed.
+
+	The UploadEvent is handed over to the UPLOAD_PROCESSING_BACKEND.
 	"""
-	if settings.IS_RUNNING_LIVE or settings.IS_RUNNING_AS_LAMBDA:
-		if "TRACING_REQUEST_ID" in os.environ:
-			token = os.environ["TRACING_REQUEST_ID"]
-		else:
-			# If this was re-queued manually the tracing ID may not be set yet.
-			event = UploadEvent.objects.get(id=upload_event_id)
-			token = str(event.token.key)
-
-		message = {
-			"id": upload_event_id,
-			"token": token,
-		}
-
-		success = True
-		try:
-			logger.info("Submitting %r to SNS", message)
-			response = sns_client().publish(
-				TopicArn=settings.SNS_PROCESS_UPLOAD_EVENT_TOPIC,
-				Message=json.dumps({"default": json.dumps(message)}),
-				MessageStructure="json"
-			)
-			logger.info("SNS Response: %s" % str(response))
-		except Exception as e:
-			logger.error("Exception raised.")
-			error_handler(e)
-			success = False
-		finally:
-			influx_metric(
-				"queue_upload_event_for_processing",
-				fields={"value": 1},
-				timestamp=now(),
-				tags={
-					"success": success,
-					"is_running_as_lambda": settings.IS_RUNNING_AS_LAMBDA,
-				}
+	backend = PROCESSING_BACKENDS[settings.UPLOAD_PROCESSING_BACKEND]
+	backend(upload_event_id)
+
+
+def claim_pending_upload_events(limit):
+	"""
+	Marks up to `limit` pending UploadEvents as PROCESSING and returns their IDs.
+	UploadEvents claimed more than UPLOAD_CLAIM_TIMEOUT seconds ago which are
+	still PROCESSING are considered abandoned and claimed again.
+
+	On PostgreSQL the rows are selected with FOR UPDATE SKIP LOCKED, so that
+	concurrent workers never claim the same UploadEvent and never wait on each other.
+	The `status IN (...)` condition matches the partial index of pending rows
+	(see migration uploads 0005).
+	"""
+	sql = (
+		"SELECT id FROM %s WHERE status IN (%%s, %%s) "
+		"AND (status = %%s OR claimed < %%s) ORDER BY id LIMIT %%s"
+	) % (connection.ops.quote_name(UploadEvent._meta.db_table))
+	if connection.vendor == "postgresql":
+		sql += " FOR UPDATE SKIP LOCKED"
+
+	claimed = now()
+	abandoned = claimed - timedelta(seconds=UPLOAD_CLAIM_TIMEOUT)
+	params = [
+		int(UploadEventStatus.UNKNOWN), int(UploadEventStatus.PROCESSING),
+		int(UploadEventStatus.UNKNOWN), connection.ops.adapt_datetimefield_value(abandoned),
+		limit,
+	]
+	with transaction.atomic():
+		with connection.cursor() as cursor:
+			cursor.execute(sql, params)
+			ids = [row[0] for row in cursor.fetchall()]
+		if ids:
+			UploadEvent.objects.filter(id__in=ids).update(
+				status=UploadEventStatus.PROCESSING, claimed=claimed
 			)
-	else:
-		logger.info("Processing UploadEvent %r locally", upload_event_id)
+
+	return ids
+
+
+def process_upload_event_by_id(upload_event_id):
+	"""
+	Processes an UploadEvent, recording any failure on the event itself
+	instead of raising. Returns the final status of the UploadEvent,
+	or None if it does not exist (anymore).
+	"""
+	try:
 		upload = UploadEvent.objects.get(id=upload_event_id)
+	except UploadEvent.DoesNotExist:
+		logger.warning("UploadEvent %r does not exist", upload_event_id)
+		return None
+
+	try:
 		upload.process()
+	except Exception as e:
+		logger.info("Processing %r failed: %s", upload, e)
+	return upload.status
@@ -0,0 +1,53 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils.timezone import now
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+from hsreplaynet.uploads.processing import (
+	UPLOAD_CLAIM_TIMEOUT, claim_pending_upload_events, process_upload_event_by_id
+)
+
+
+class ClaimPendingUploadEventsTests(TestCase):
+	def create_upload_event(self, status, claimed=None):
+		return UploadEvent.objects.create(
+			type=UploadEventType.POWER_LOG,
+			upload_ip="127.0.0.1",
+			metadata="{}",
+			status=status,
+			claimed=claimed,
+		)
+
+	def test_claim_pending_upload_events(self):
+		pending = self.create_upload_event(UploadEventStatus.UNKNOWN)
+		self.create_upload_event(UploadEventStatus.SUCCESS)
+
+		self.assertEqual(claim_pending_upload_events(10), [pending.id])
+		pending.refresh_from_db()
+		self.assertEqual(pending.status, UploadEventStatus.PROCESSING)
+		self.assertIsNotNone(pending.claimed)
+
+	def test_reclaim_abandoned_upload_events(self):
+		timeout = timedelta(seconds=UPLOAD_CLAIM_TIMEOUT)
+		abandoned = self.create_upload_event(
+			UploadEventStatus.PROCESSING, claimed=now() - timeout - timedelta(minutes=1)
+		)
+		# Still being processed
+		self.create_upload_event(
+			UploadEventStatus.PROCESSING, claimed=now() - timeout + timedelta(minutes=1)
+		)
+		# Being processed outside of the workers (eg. inline or on Lambda)
+		self.create_upload_event(UploadEventStatus.PROCESSING)
+
+		self.assertEqual(claim_pending_upload_events(10), [abandoned.id])
+
+	def test_no_upload_event_claimed_twice(self):
+		ids = [self.create_upload_event(UploadEventStatus.UNKNOWN).id for i in range(5)]
+
+		claimed = claim_pending_upload_events(3) + claim_pending_upload_events(3)
+		self.assertEqual(sorted(claimed), ids)
+		self.assertEqual(claim_pending_upload_events(3), [])
+
+
+class ProcessUploadEventByIdTests(TestCase):
+	def test_deleted_upload_event(self):
+		self.assertIsNone(process_upload_event_by_id(1))
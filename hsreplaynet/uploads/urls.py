@@ -1,7 +1,8 @@
 from django.conf.urls import url
-from .views import UploadDetailView
+from .views import UploadDetailView, UploadPutView
 
 
 urlpatterns = [
 	url(r"^upload/(?P<shortid>[\w-]+)/$", UploadDetailView.as_view(), name="upload_detail"),
+	url(r"^put/(?P<signature>[\w:-]+)/$", UploadPutView.as_view(), name="upload_put"),
 ]
@@ -1,7 +1,14 @@
-from django.http import HttpResponseRedirect
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
-from .models import UploadEvent
+from hsreplaynet.utils.storage import GZIP_SUFFIX
+from .models import UploadEvent, UploadEventStatus, UploadEventType
+from .presigned import get_put_url_shortid, queue_uploaded_file
 
 
 class UploadDetailView(View):
@@ -11,3 +18,34 @@ class UploadDetailView(View):
 			return HttpResponseRedirect(upload.game.get_absolute_url())
 
 		return render(request, "uploads/processing.html", {"upload": upload})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadPutView(View):
+	"""
+	Receives the file of a direct upload when the storage is not S3,
+	standing in for a presigned S3 PUT URL and its event notification.
+	Gzipped bodies (Content-Encoding: gzip) are stored as they are,
+	others are compressed by the storage.
+	"""
+	def put(self, request, signature):
+		try:
+			shortid = get_put_url_shortid(signature)
+		except signing.BadSignature:
+			return HttpResponseForbidden("Invalid or expired upload URL.")
+
+		upload = get_object_or_404(
+			UploadEvent, shortid=shortid, status=UploadEventStatus.PENDING_UPLOAD
+		)
+		# Stream the body into the storage rather than buffering it in memory
+		content = File(request)
+		content.content_type = UploadEventType(upload.type).content_type
+		name = upload.file.name
+		if request.META.get("HTTP_CONTENT_ENCODING") == "gzip":
+			# Already compressed, as required by S3. The suffix keeps the storage
+			# from compressing it again and has it decompressed when read.
+			name += GZIP_SUFFIX
+		name = default_storage.save(name, content)
+		queue_uploaded_file(name)
+
+		return HttpResponse(status=200)
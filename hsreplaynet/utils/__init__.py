@@ -1,25 +1,76 @@
 import binascii
+import calendar
 import datetime
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
+from dateutil.parser import parse as dateutil_parse
 from dateutil.relativedelta import relativedelta
 from uuid import UUID
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.timezone import is_naive, make_aware
 
 
-_timing_start = time.clock()
+# perf_counter() and process_time() are not available on Python 2 (Lambda)
+wall_clock = getattr(time, "perf_counter", time.time)
+cpu_clock = getattr(time, "process_time", None) or time.clock
+
+_timing_start = wall_clock()
 logger = logging.getLogger(__file__)
 
 
 def _time_elapsed():
-	return (time.clock() - _timing_start) * 10000
+	"""
+	Returns the wall time elapsed since the last reset, in milliseconds.
+	"""
+	return (wall_clock() - _timing_start) * 1000
 
 
 def _reset_time_elapsed():
 	global _timing_start
-	_timing_start = time.clock()
+	_timing_start = wall_clock()
+
+
+class LRUCache(object):
+	"""
+	A bounded mapping which evicts its least recently used keys first.
+	Keeps count of its hits and misses.
+	"""
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._data)
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				value = self._data.pop(key)
+			except KeyError:
+				self.misses += 1
+				return default
+			# Re-insert the key to mark it as the most recently used
+			self._data[key] = value
+			self.hits += 1
+			return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._data.pop(key, None)
+			self._data[key] = value
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
 
 
 def generate_key():
@@ -36,15 +87,64 @@ def get_client_ip(request):
 	return request.META.get("REMOTE_ADDR")
 
 
+def aware_datetime(value):
+	"""
+	Parses a datetime string, in the current timezone if it has none.
+	"""
+	ret = dateutil_parse(value)
+	if is_naive(ret):
+		ret = make_aware(ret)
+	return ret
+
+
+def iter_ids(queryset, chunk_size):
+	"""
+	Yields the IDs of the queryset in ascending order, fetching them
+	chunk_size at a time (keyset pagination on the primary key).
+	"""
+	last_id = 0
+	while True:
+		chunk = list(
+			queryset.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size]
+		)
+		if not chunk:
+			return
+		for id in chunk:
+			yield id
+		last_id = chunk[-1]
+
+
+DEDUPLICATION_MARGIN = datetime.timedelta(hours=6)
+
+
 def deduplication_time_range(ts):
 	"""
 	From a datetime, return a tuple of (datetime_min, datetime_max)
 	of the range margin around that datetime allowed for deduplication.
 	"""
-	margin = datetime.timedelta(hours=6)
+	margin = DEDUPLICATION_MARGIN
 	return ts - margin, ts + margin
 
 
+def deduplication_bucket(ts):
+	"""
+	From a datetime, return the index of the deduplication bucket it falls in.
+	Buckets are twice as wide as the deduplication margin, so any range
+	returned by deduplication_time_range() overlaps at most three of them.
+	"""
+	bucket_size = int(DEDUPLICATION_MARGIN.total_seconds()) * 2
+	return calendar.timegm(ts.utctimetuple()) // bucket_size
+
+
+def deduplication_buckets(ts):
+	"""
+	From a datetime, return the list of deduplication buckets overlapping
+	with the range margin around that datetime allowed for deduplication.
+	"""
+	lower, upper = deduplication_time_range(ts)
+	return list(range(deduplication_bucket(lower), deduplication_bucket(upper) + 1))
+
+
 def guess_ladder_season(timestamp):
 	epoch = datetime.datetime(2014, 1, 1, tzinfo=timestamp.tzinfo)
 	epoch_season = 1
@@ -0,0 +1,38 @@
+from django.db import connections, router
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+
+
+def bulk_update(model, objs, fields, batch_size=500):
+	"""
+	Saves the given fields of every object in objs with one UPDATE per batch,
+	using a CASE on the primary key for each field.
+	QuerySet.bulk_update() is not available on this version of Django.
+	Returns the number of updated rows.
+	"""
+	updated = 0
+	fields = [model._meta.get_field(name) for name in fields]
+	# Each object binds its primary key and value for every field,
+	# plus its primary key in the IN clause.
+	connection = connections[router.db_for_write(model)]
+	max_batch_size = connection.ops.bulk_batch_size(["pk", "pk"] * len(fields) + ["pk"], objs)
+	batch_size = min(batch_size, max_batch_size) if max_batch_size else batch_size
+
+	for i in range(0, len(objs), batch_size):
+		batch = objs[i:i + batch_size]
+		values = {}
+		for field in fields:
+			# Value() adapts each value with the field's get_db_prep_value()
+			whens = [
+				When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+				for obj in batch
+			]
+			case = Case(*whens, output_field=field)
+			if connection.vendor == "postgresql":
+				# PostgreSQL types the CASE from its (untyped) parameters
+				case = Cast(case, output_field=field)
+			values[field.name] = case
+		pks = [obj.pk for obj in batch]
+		updated += model._default_manager.filter(pk__in=pks).update(**values)
+
+	return updated
@@ -1,11 +1,13 @@
+import atexit
 import json
 import os
-import time
+import threading
+from collections import deque
 from contextlib import contextmanager
 from functools import wraps
 from django.conf import settings
 from django.utils.timezone import now
-from . import logger
+from . import cpu_clock, logger, wall_clock
 
 
 if "raven.contrib.django.raven_compat" in settings.INSTALLED_APPS:
@@ -21,6 +23,21 @@ def error_handler(e):
 		logger.exception(e)
 
 
+def get_record_message(record):
+	"""
+	Returns the message carried by a Lambda event record.
+	Records come either straight from SNS or from an SQS queue, in which
+	case the body may itself be an SNS notification envelope.
+	"""
+	if "Sns" in record:
+		return json.loads(record["Sns"]["Message"])
+
+	body = json.loads(record["body"])
+	if "Message" in body and "TopicArn" in body:
+		return json.loads(body["Message"])
+	return body
+
+
 def get_tracing_id(event, context):
 	"""
 	Returns the Authorization token as a unique identifier.
@@ -28,8 +45,21 @@ def get_tracing_id(event, context):
 	"""
 	if "Records" in event:
 		# We are in the processing lambda
-		message = json.loads(event["Records"][0]["Sns"]["Message"])
-		return message["token"]
+		tokens = set()
+		for record in event["Records"]:
+			if "s3" in record:
+				# We are in the uploaded file notification lambda.
+				# Object keys are uploads/YYYY/MM/DD/<token>/<file>
+				tokens.add(record["s3"]["object"]["key"].split("/")[-2])
+			else:
+				try:
+					tokens.add(get_record_message(record)["token"])
+				except (KeyError, TypeError, ValueError):
+					# Malformed records are reported by the handler itself
+					pass
+		if len(tokens) == 1:
+			return tokens.pop()
+		return "batch-%i" % (len(event["Records"]))
 
 	auth_header = None
 
@@ -100,6 +130,9 @@ def lambda_handler(func):
 		finally:
 			from django.db import connection
 			connection.close()
+			# The background writer may not get to run between invocations
+			if influx_buffer is not None:
+				influx_buffer.flush()
 
 	return wrapper
 
@@ -125,12 +158,102 @@ except ImportError as e:
 	influx = None
 
 
+class InfluxBuffer(object):
+	"""
+	Accumulates points in memory and writes them to InfluxDB in batches
+	from a background thread, once `batch_size` points are pending or
+	every `flush_interval` seconds.
+	Writers never block on InfluxDB: when `max_size` points are already
+	pending, new points are dropped and counted instead.
+	"""
+	def __init__(self, client, batch_size=500, flush_interval=10, max_size=10000):
+		self.client = client
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.max_size = max_size
+		self.points = deque()
+		self.num_dropped = 0
+		self._pending_dropped = 0
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._thread_pid = None
+
+	def add(self, points):
+		self._ensure_thread()
+		with self._lock:
+			room = max(self.max_size - len(self.points), 0)
+			if len(points) > room:
+				self.num_dropped += len(points) - room
+				self._pending_dropped += len(points) - room
+				points = points[:room]
+			self.points.extend(points)
+			full = len(self.points) >= self.batch_size
+
+		if full:
+			self._wakeup.set()
+
+	def flush(self):
+		with self._flush_lock:
+			with self._lock:
+				points = list(self.points)
+				self.points.clear()
+				dropped, self._pending_dropped = self._pending_dropped, 0
+
+			if dropped:
+				points.append({
+					"measurement": "influx_dropped_points",
+					"tags": {},
+					"fields": {"count": dropped},
+					"time": now().isoformat(),
+				})
+
+			for i in range(0, len(points), self.batch_size):
+				try:
+					self.client.write_points(points[i:i + self.batch_size])
+				except Exception as e:
+					# Can happen if Influx if not available for example
+					error_handler(e)
+
+	def _ensure_thread(self):
+		# Threads do not survive a fork, so every process needs its own
+		pid = os.getpid()
+		if self._thread_pid == pid:
+			return
+		with self._lock:
+			if self._thread_pid == pid:
+				return
+			if self._thread_pid is not None:
+				# Forked: the parent process still owns the pending points
+				self.points.clear()
+				self._pending_dropped = 0
+			self._thread_pid = pid
+			thread = threading.Thread(target=self._run, name="influx-buffer")
+			thread.daemon = True
+			thread.start()
+
+	def _run(self):
+		while True:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			self.flush()
+
+
+if influx is not None:
+	influx_buffer = InfluxBuffer(
+		influx,
+		batch_size=getattr(settings, "INFLUX_BATCH_SIZE", 500),
+		flush_interval=getattr(settings, "INFLUX_FLUSH_INTERVAL", 10),
+		max_size=getattr(settings, "INFLUX_BUFFER_SIZE", 10000),
+	)
+	atexit.register(influx_buffer.flush)
+else:
+	influx_buffer = None
+
+
 def influx_write_payload(payload):
-	try:
-		influx.write_points(payload)
-	except Exception as e:
-		# Can happen if Influx if not available for example
-		error_handler(e)
+	if influx_buffer is not None:
+		influx_buffer.add(payload)
 
 
 def influx_metric(measure, fields, timestamp=None, **kwargs):
@@ -149,15 +272,48 @@ def influx_metric(measure, fields, timestamp=None, **kwargs):
 		influx_write_payload([payload])
 
 
+def influx_cache_metric(measure, cache, **kwargs):
+	"""
+	Reports the hit/miss counters and the size of an LRUCache.
+	Additional kwargs are passed to InfluxDB as tags.
+	"""
+	fields = {
+		"hits": cache.hits,
+		"misses": cache.misses,
+		"size": len(cache),
+	}
+	influx_metric(measure, fields, **kwargs)
+
+
+# Upper bounds (in ms) of the cumulative latency buckets reported by influx_timer()
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def get_latency_fields(wall_ms):
+	"""
+	Returns cumulative histogram fields for a duration: "le_<bound>" is 1
+	if the duration is at most <bound> ms, 0 otherwise.
+	Summing them (or taking their mean) over a period gives the number
+	(or ratio) of measurements within each latency objective.
+	"""
+	return dict(
+		("le_%i" % (bound), int(wall_ms <= bound)) for bound in LATENCY_BUCKETS_MS
+	)
+
+
 @contextmanager
 def influx_timer(measure, timestamp=None, **kwargs):
 	"""
 	Reports the duration of the context manager.
+	`value` and `wall_ms` are the elapsed wall time, `cpu_ms` the CPU time
+	of the process, both in milliseconds, along with latency buckets.
 	Additional kwargs are passed to InfluxDB as tags.
 	"""
 	if influx is None:
+		yield
 		return
-	start_time = time.clock()
+	start_time = wall_clock()
+	start_cpu_time = cpu_clock()
 	exception_raised = False
 	if timestamp is None:
 		timestamp = now()
@@ -167,18 +323,128 @@ def influx_timer(measure, timestamp=None, **kwargs):
 		exception_raised = True
 		raise
 	finally:
-		stop_time = time.clock()
-		duration = (stop_time - start_time) * 10000
+		wall_ms = (wall_clock() - start_time) * 1000
+		cpu_ms = (cpu_clock() - start_cpu_time) * 1000
 
 		tags = kwargs
 		tags["exception_thrown"] = exception_raised
+		fields = get_latency_fields(wall_ms)
+		fields["value"] = wall_ms
+		fields["wall_ms"] = wall_ms
+		fields["cpu_ms"] = cpu_ms
 		payload = {
 			"measurement": measure,
 			"tags": tags,
-			"fields": {
-				"value": duration,
-			}
+			"fields": fields,
 		}
 
 		payload["time"] = timestamp.isoformat()
 		influx_write_payload([payload])
+
+
+_traces = threading.local()
+
+
+class influx_span(object):
+	"""
+	Times a stage of the current influx_trace(), as a context manager
+	or as a decorator. Spans can be nested; a nested span is named after
+	its parents, eg. "transaction.players".
+	Additional kwargs are passed to InfluxDB as tags.
+	Does nothing when no trace is being collected.
+	"""
+	def __init__(self, name, **kwargs):
+		self.name = name
+		self.tags = kwargs
+
+	def __call__(self, func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with influx_span(self.name, **self.tags):
+				return func(*args, **kwargs)
+		return wrapper
+
+	def __enter__(self):
+		trace = getattr(_traces, "current", None)
+		self._trace = trace
+		if trace is None:
+			return self
+		self._probes = [probe() for probe in trace["probes"]]
+		self.start_time = wall_clock()
+		trace["stack"].append(self.name)
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		trace = self._trace
+		if trace is None:
+			return
+		duration = (wall_clock() - self.start_time) * 1000
+		span = ".".join(trace["stack"])
+		trace["stack"].pop()
+
+		tags = dict(trace["tags"])
+		tags.update(self.tags)
+		tags["span"] = span
+		tags["exception_thrown"] = exc_type is not None
+		fields = {"duration_ms": duration}
+		for stop in self._probes:
+			fields.update(stop())
+		trace["points"].append({
+			"measurement": trace["measurement"],
+			"tags": tags,
+			"fields": fields,
+			"time": now().isoformat(),
+		})
+
+
+@contextmanager
+def influx_trace(measure, **kwargs):
+	"""
+	Collects the influx_span() of the wrapped block (in the current
+	thread) and writes them to InfluxDB in a single batch at the end.
+	Additional kwargs are passed as tags of every span.
+	"""
+	if influx is None or getattr(_traces, "current", None) is not None:
+		# Nested traces are folded into the outer one
+		yield
+		return
+
+	_traces.current = {
+		"measurement": measure,
+		"tags": kwargs,
+		"stack": [],
+		"points": [],
+		"probes": [],
+	}
+	try:
+		yield
+	finally:
+		points = _traces.current["points"]
+		_traces.current = None
+		if points:
+			influx_write_payload(points)
+
+
+@contextmanager
+def collect_spans(*probes):
+	"""
+	Collects the influx_span() of the wrapped block (in the current
+	thread) into the yielded list instead of writing them to InfluxDB.
+	Each probe is called when a span starts and returns a callable,
+	which is called when the span ends and returns additional fields.
+	"""
+	if getattr(_traces, "current", None) is not None:
+		raise RuntimeError("Cannot collect spans inside of an influx_trace()")
+
+	points = []
+	_traces.current = {
+		"measurement": "spans",
+		"tags": {},
+		"stack": [],
+		"points": points,
+		"probes": probes,
+	}
+	try:
+		yield points
+	finally:
+		_traces.current = None
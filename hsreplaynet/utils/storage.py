@@ -0,0 +1,69 @@
+import gzip
+import mimetypes
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import force_bytes
+
+
+GZIP_SUFFIX = ".gz"
+
+
+@deconstructible
+class GzipFileSystemStorage(FileSystemStorage):
+	"""
+	A FileSystemStorage which compresses the files it saves whose content
+	type is in GZIP_CONTENT_TYPES, as S3Boto3Storage does with AWS_IS_GZIPPED.
+
+	Compressed files are saved with a ".gz" suffix, so that they get served
+	with a `Content-Encoding: gzip` header, and are decompressed when read back.
+	"""
+	def __init__(self, *args, **kwargs):
+		self.gzip_content_types = kwargs.pop(
+			"gzip_content_types", getattr(settings, "GZIP_CONTENT_TYPES", ())
+		)
+		super(GzipFileSystemStorage, self).__init__(*args, **kwargs)
+
+	def _compress_content(self, content):
+		zbuf = SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+		with gzip.GzipFile(mode="wb", fileobj=zbuf, mtime=0) as zfile:
+			for chunk in content.chunks():
+				zfile.write(force_bytes(chunk))
+		zbuf.seek(0)
+		return File(zbuf)
+
+	def _open(self, name, mode="rb"):
+		if not name.endswith(GZIP_SUFFIX):
+			return super(GzipFileSystemStorage, self)._open(name, mode)
+		# GzipFile only supports binary reads
+		return File(gzip.GzipFile(self.path(name), "rb"))
+
+	def save(self, name, content, max_length=None):
+		if name is None:
+			name = content.name
+		# Like S3Boto3Storage, prefer the content type set on the file
+		content_type, encoding = mimetypes.guess_type(name)
+		content_type = getattr(content, "content_type", None) or content_type
+		content_type = content_type or "application/octet-stream"
+		if encoding is None and content_type in self.gzip_content_types:
+			if not hasattr(content, "chunks"):
+				content = File(content, name)
+			name += GZIP_SUFFIX
+			content = self._compress_content(content)
+		return super(GzipFileSystemStorage, self).save(name, content, max_length)
+
+
+def is_gzipped(storage, name):
+	"""
+	Returns whether the file is stored gzipped: with a ".gz" suffix
+	(GzipFileSystemStorage) or a gzip Content-Encoding (S3Boto3Storage).
+	"""
+	if name.endswith(GZIP_SUFFIX):
+		return True
+	bucket = getattr(storage, "bucket", None)
+	if bucket is None:
+		return False
+	obj = bucket.Object(storage._normalize_name(storage._clean_name(name)))
+	return obj.content_encoding == "gzip"
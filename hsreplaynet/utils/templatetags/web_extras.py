@@ -1,12 +1,21 @@
 from django import template
 from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from humanize import naturaldelta, naturaltime
 from datetime import datetime
 from hsreplaynet.games.models import GameReplay
+from hsreplaynet.utils import wall_clock
 
 
 register = template.Library()
 
+# Seconds a process keeps the featured replay before checking the shared cache
+FEATURED_GAME_CACHE_TIMEOUT = getattr(settings, "FEATURED_GAME_CACHE_TIMEOUT", 60)
+
+# {shortid: (expires, replay)}; replay is None if there is no such replay
+_featured_game = {}
+
 
 @register.filter
 def human_duration(value):
@@ -29,13 +38,28 @@ def get_featured_game():
 	if not id:
 		return
 
+	entry = _featured_game.get(id)
+	if entry is not None and entry[0] > wall_clock():
+		return entry[1]
+
 	try:
-		replay = GameReplay.objects.get(shortid=id)
+		replay = GameReplay.objects.get_cached(id)
 	except GameReplay.DoesNotExist:
 		replay = None
+
+	# Only ever keep the current FEATURED_GAME_ID
+	_featured_game.clear()
+	_featured_game[id] = (wall_clock() + FEATURED_GAME_CACHE_TIMEOUT, replay)
 	return replay
 
 
+@receiver(post_save, sender=GameReplay)
+@receiver(post_delete, sender=GameReplay)
+def invalidate_featured_game(sender, instance, **kwargs):
+	# Other processes pick up the change once FEATURED_GAME_CACHE_TIMEOUT expires
+	_featured_game.pop(instance.shortid, None)
+
+
 @register.simple_tag(takes_context=True)
 def hearthstonejson(context, build=None, locale="enUS"):
 	if not build:
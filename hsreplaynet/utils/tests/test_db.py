@@ -0,0 +1,32 @@
+from datetime import datetime
+import pytz
+from django.test import TestCase
+from hearthstone.enums import CardType
+from hsreplaynet.cards.models import Card
+from hsreplaynet.scenarios.models import Adventure
+from hsreplaynet.utils.db import bulk_update
+
+
+class BulkUpdateTests(TestCase):
+	def test_bulk_update_large_batch(self):
+		# More parameters than SQLite allows in a single query
+		cards = Card.objects.bulk_create([
+			Card(id="TEST_%03i" % (i), name="Card %i" % (i), type=CardType.MINION)
+			for i in range(600)
+		])
+		for card in cards:
+			card.name += " (updated)"
+			card.cost = 1
+
+		self.assertEqual(bulk_update(Card, cards, ["name", "cost"], batch_size=500), 600)
+		self.assertEqual(Card.objects.filter(name__endswith=" (updated)", cost=1).count(), 600)
+
+	def test_bulk_update_datetime(self):
+		adventures = [Adventure.objects.create(name="Adventure %i" % (i), build=1) for i in range(2)]
+		updated = datetime(2016, 7, 14, 3, 0, 0, tzinfo=pytz.utc)
+		for adventure in adventures:
+			adventure.updated = updated
+
+		self.assertEqual(bulk_update(Adventure, adventures, ["updated"]), 2)
+		for adventure in Adventure.objects.all():
+			self.assertEqual(adventure.updated, updated)
@@ -0,0 +1,35 @@
+from datetime import datetime
+import pytz
+from django.test import SimpleTestCase
+from hsreplaynet.utils import (
+	deduplication_bucket, deduplication_buckets, deduplication_time_range
+)
+
+
+class DeduplicationBucketTests(SimpleTestCase):
+	def setUp(self):
+		# Buckets are 12 hours wide and aligned on the epoch
+		self.before = datetime(2016, 7, 14, 11, 59, 0, tzinfo=pytz.utc)
+		self.after = datetime(2016, 7, 14, 12, 1, 0, tzinfo=pytz.utc)
+
+	def test_bucket_boundary(self):
+		self.assertEqual(deduplication_bucket(self.after), deduplication_bucket(self.before) + 1)
+
+	def test_buckets_overlap_boundary(self):
+		# Either side of the boundary must find a game on the other side
+		self.assertIn(deduplication_bucket(self.before), deduplication_buckets(self.after))
+		self.assertIn(deduplication_bucket(self.after), deduplication_buckets(self.before))
+
+	def test_buckets_cover_time_range(self):
+		for ts in (self.before, self.after):
+			lower, upper = deduplication_time_range(ts)
+			buckets = deduplication_buckets(ts)
+			self.assertLessEqual(len(buckets), 3)
+			self.assertEqual(buckets[0], deduplication_bucket(lower))
+			self.assertEqual(buckets[-1], deduplication_bucket(upper))
+
+	def test_timezone(self):
+		tz = pytz.timezone("America/Los_Angeles")
+		self.assertEqual(
+			deduplication_bucket(self.before.astimezone(tz)), deduplication_bucket(self.before)
+		)
@@ -0,0 +1,31 @@
+from django.test import SimpleTestCase
+from hsreplaynet.utils.instrumentation import collect_spans, influx_span
+
+
+class CollectSpansTests(SimpleTestCase):
+	def test_collect_spans(self):
+		calls = []
+
+		def probe():
+			calls.append("start")
+			return lambda: {"calls": len(calls)}
+
+		with collect_spans(probe) as spans:
+			with influx_span("transaction"):
+				with influx_span("save", unified=False):
+					pass
+
+		self.assertEqual([point["tags"]["span"] for point in spans], [
+			"transaction.save", "transaction"
+		])
+		self.assertEqual(spans[0]["tags"]["unified"], False)
+		self.assertEqual(spans[0]["fields"]["calls"], 2)
+		self.assertIn("duration_ms", spans[1]["fields"])
+
+	def test_no_spans_outside_of_collection(self):
+		with collect_spans() as spans:
+			pass
+		with influx_span("parse"):
+			pass
+
+		self.assertEqual(spans, [])
@@ -0,0 +1,45 @@
+import gzip
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+from hsreplaynet.utils.storage import GzipFileSystemStorage, is_gzipped
+
+
+class GzipFileSystemStorageTests(SimpleTestCase):
+	def setUp(self):
+		self.location = tempfile.mkdtemp()
+		self.storage = GzipFileSystemStorage(
+			location=self.location, gzip_content_types=("text/plain", )
+		)
+		self.data = b"D 03:14:15.9265358 GameState.DebugPrintPower() - CREATE_GAME\n" * 100
+
+	def tearDown(self):
+		shutil.rmtree(self.location)
+
+	def test_round_trip(self):
+		content = ContentFile(self.data)
+		content.content_type = "text/plain"
+		name = self.storage.save("uploads/power.log", content)
+
+		self.assertEqual(name, "uploads/power.log.gz")
+		self.assertTrue(is_gzipped(self.storage, name))
+		with open(self.storage.path(name), "rb") as f:
+			self.assertEqual(gzip.decompress(f.read()), self.data)
+		self.assertLess(self.storage.size(name), len(self.data))
+
+		# Reads are transparently decompressed, including line by line
+		with self.storage.open(name, "rb") as f:
+			self.assertEqual(f.read(), self.data)
+		with self.storage.open(name, "rb") as f:
+			self.assertEqual(b"".join(line for line in f), self.data)
+
+	def test_other_content_types_are_not_compressed(self):
+		content = ContentFile(self.data)
+		content.content_type = "application/octet-stream"
+		name = self.storage.save("uploads/power.bin", content)
+
+		self.assertEqual(name, "uploads/power.bin")
+		self.assertFalse(is_gzipped(self.storage, name))
+		with self.storage.open(name, "rb") as f:
+			self.assertEqual(f.read(), self.data)
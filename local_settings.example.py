@@ -3,7 +3,7 @@ ALLOWED_HOSTS = ("*", )
 
 ACCOUNT_DEFAULT_HTTP_PROTOCOL = "http"
 
-DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
+DEFAULT_FILE_STORAGE = "hsreplaynet.utils.storage.GzipFileSystemStorage"
 MEDIA_URL = "/media/"
 STATIC_URL = "/static/"
 JOUST_STATIC_URL = "//static.hsreplay.net/static/joust/"
@@ -48,6 +48,8 @@ def _update_static_files(venv, path):
 
 def _update_database(venv, path):
 	sudo("%s/bin/python %s/manage.py migrate --noinput" % (venv, path), user="www-data")
+	# The shared cache lives in the database (see settings.CACHES)
+	sudo("%s/bin/python %s/manage.py createcachetable" % (venv, path), user="www-data")
 
 
 def _restart_web_server():